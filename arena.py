@@ -0,0 +1,194 @@
+"""
+Headless arena: plays thousands of Othello games at once between two players, GPT checkpoints or baselines, with
+no terminal, input() or sleep in the loop. All live games advance one ply per step on BatchedOthelloBoards (legality
+and forfeits), each GPT player runs one batched forward per step over every game with a KV cache, and the report
+gives win / draw / loss of the first player, the legal-move rate of the GPT players (how often their unconstrained
+choice is legal, illegal choices are replaced by the legal-masked one) and games per second.
+The first move of every game is a random legal one, the models have no start token; colors alternate between games.
+Usage: python arena.py --player ./ckpts/gpt_synthetic.ckpt --opponent random --games 4096
+"""
+import time
+import argparse
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from data.othello import BatchedOthelloBoards
+from data.bitboard import get_flips_batch, unpack_batch
+from data.tokenizer import OthelloTokenizer
+from mingpt.model import GPT, GPTConfig
+from mingpt.utils import top_k_logits, mask_logits, legal_token_mask
+
+
+def random_moves(valid, rng):
+    # a uniform pick among the legal moves of every game, -1 where there is none
+    keys = np.where(valid, rng.random(valid.shape), -1.)
+    return np.where(valid.any(axis=1), keys.argmax(axis=1), -1)
+
+
+class RandomPlayer():
+    name = "random"
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def reset(self, num_games):
+        pass
+
+    def observe(self, moves):
+        pass
+
+    def choose(self, boards, valid, games):
+        return random_moves(valid[games], self.rng)
+
+
+class FlipsPlayer():
+    # greedy baseline: the legal move flipping the most discs, ties broken at random
+    name = "flips"
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def reset(self, num_games):
+        pass
+
+    def observe(self, moves):
+        pass
+
+    def choose(self, boards, valid, games):
+        mover = boards.get_mover()[games]
+        own = np.where(mover == 1, boards.black[games], boards.white[games])
+        opp = np.where(mover == 1, boards.white[games], boards.black[games])
+        flips = np.zeros((len(own), 64))
+        for square in range(64):
+            bit = np.full(len(own), np.uint64(1) << np.uint64(square), dtype=np.uint64)
+            flips[:, square] = unpack_batch(get_flips_batch(own, opp, bit)).sum(axis=1)
+        score = np.where(valid[games], flips + self.rng.random(flips.shape), -1.)
+        return score.argmax(axis=1)
+
+
+class GPTPlayer():
+    def __init__(self, ckpt_path, device, sample=False, temperature=1.0, top_k=None, n_layer=8, n_head=8, n_embd=512):
+        self.name = ckpt_path
+        self.device = device
+        self.sample = sample
+        self.temperature = temperature
+        self.top_k = top_k
+        self.tokenizer = OthelloTokenizer.for_checkpoint(ckpt_path)
+        mconf = GPTConfig(self.tokenizer.vocab_size, self.tokenizer.block_size, n_layer=n_layer, n_head=n_head, n_embd=n_embd)
+        self.model = GPT(mconf)
+        self.model.load_state_dict(torch.load(ckpt_path, map_location=device))
+        self.model.to(device).eval()
+        self.proposed = 0
+        self.legal = 0
+
+    def reset(self, num_games):
+        self.past = None
+        self.logits = None
+
+    @torch.no_grad()
+    def observe(self, moves):
+        # feed the column of moves just played (negative for finished games, fed as padding) to the KV cache
+        x = torch.from_numpy(self.tokenizer.encode(moves)).unsqueeze(1).to(self.device)
+        logits, _, self.past = self.model(x, past_key_values=self.past, use_cache=True)
+        self.logits = logits[:, -1]
+
+    def _pick(self, logits):
+        if self.top_k is not None:
+            logits = top_k_logits(logits, self.top_k)
+        if self.sample:
+            return torch.multinomial(F.softmax(logits, dim=-1), num_samples=1)[:, 0]
+        return logits.argmax(dim=-1)
+
+    @torch.no_grad()
+    def choose(self, boards, valid, games):
+        logits = self.logits[torch.from_numpy(np.flatnonzero(games)).to(self.device)] / self.temperature
+        mask = legal_token_mask(valid[games], self.tokenizer).to(self.device)
+        free = self._pick(logits)
+        legal = mask.gather(1, free[:, None])[:, 0]
+        # resampling from the masked distribution when the free pick is illegal is the same as rejection sampling
+        tokens = torch.where(legal, free, self._pick(mask_logits(logits, mask)))
+        self.proposed += len(free)
+        self.legal += int(legal.sum())
+        return self.tokenizer.decode(tokens.cpu().numpy())
+
+
+def make_player(spec, args, rng):
+    if spec == "random":
+        return RandomPlayer(rng)
+    if spec == "flips":
+        return FlipsPlayer(rng)
+    return GPTPlayer(spec, args.device, args.sample, args.temperature, args.top_k, args.n_layer, args.n_head, args.n_embd)
+
+
+def play(player, opponent, num_games, rng):
+    # num_games games in lockstep, player is black in the even ones; returns [N] disc counts of player and opponent
+    # and the number of moves played
+    players = [player] if player is opponent else [player, opponent]
+    for p in players:
+        p.reset(num_games)
+    boards = BatchedOthelloBoards(num_games)
+    player_color = np.where(np.arange(num_games) % 2 == 0, 1, -1)
+    num_moves = 0
+    for t in range(60):
+        mover = boards.get_mover()
+        alive = mover != 0
+        if not alive.any():
+            break
+        valid = boards.get_valid_array()
+        move = np.full(num_games, -1, dtype=np.int64)
+        if t == 0:
+            move = random_moves(valid, rng)
+        else:
+            for p, color in [(player, player_color), (opponent, -player_color)]:
+                games = alive & (mover == color)
+                if games.any():
+                    move[games] = p.choose(boards, valid, games)
+        boards.umpire(move)
+        num_moves += int(alive.sum())
+        if t < 59:  # a 60th move is never followed by another one
+            for p in players:
+                p.observe(move)
+    black, white = boards.get_score()
+    mine = np.where(player_color == 1, black, white)
+    theirs = np.where(player_color == 1, white, black)
+    return mine, theirs, num_moves
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless batched Othello arena')
+    parser.add_argument('--player', default="./ckpts/gpt_synthetic.ckpt", type=str, help='checkpoint, random or flips')
+    parser.add_argument('--opponent', default="random", type=str, help='checkpoint, random or flips')
+    parser.add_argument('--games', default=4096, type=int)
+    parser.add_argument('--batch_size', default=1024, type=int, help='games played at once')
+    parser.add_argument('--sample', action='store_true', help='sample moves instead of taking the most likely one')
+    parser.add_argument('--temperature', default=1.0, type=float)
+    parser.add_argument('--top_k', default=None, type=int)
+    parser.add_argument('--n_layer', default=8, type=int)
+    parser.add_argument('--n_head', default=8, type=int)
+    parser.add_argument('--n_embd', default=512, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args, _ = parser.parse_known_args()
+    args.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    rng = np.random.default_rng(args.seed)
+    torch.manual_seed(args.seed)
+    player = make_player(args.player, args, rng)
+    opponent = player if args.opponent == args.player else make_player(args.opponent, args, rng)
+
+    results, num_moves = [], 0
+    t_start = time.perf_counter()
+    for start in range(0, args.games, args.batch_size):
+        mine, theirs, moves = play(player, opponent, min(args.batch_size, args.games - start), rng)
+        results.append(mine.astype(int) - theirs.astype(int))
+        num_moves += moves
+    elapsed = time.perf_counter() - t_start
+    diff = np.concatenate(results)
+
+    print(f"{player.name} vs {opponent.name}: {len(diff)} games, half with each color")
+    print(f"win {np.mean(diff > 0):.1%}, draw {np.mean(diff == 0):.1%}, loss {np.mean(diff < 0):.1%}, "
+          f"mean disc difference {diff.mean():+.2f}")
+    for p in ([player] if player is opponent else [player, opponent]):
+        if isinstance(p, GPTPlayer):
+            print(f"legal-move rate of {p.name}: {p.legal / max(p.proposed, 1):.2%} of {p.proposed} moves")
+    print(f"{len(diff) / elapsed:.1f} games/s, {num_moves / elapsed:.0f} moves/s ({elapsed:.2f} s)")
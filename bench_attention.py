@@ -0,0 +1,121 @@
+"""
+Compare the explicit attention of CausalSelfAttention (full (B, nh, T, T) matrix, masked_fill, softmax, dropout)
+against the fused F.scaled_dot_product_attention path on CPU, for the 8-layer 512-d model used in this repo:
+check that both give the same logits, then report latency and peak memory of inference and of a training step.
+Every measurement runs in a fresh process, peak memory is the growth of the resident set during one step (Linux).
+Usage: python bench_attention.py --batch_size 64
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+import torch
+
+from mingpt.model import GPT, GPTConfig
+
+
+def make_model(fast, seed=0):
+    torch.manual_seed(seed)
+    mconf = GPTConfig(61, 59, n_layer=8, n_head=8, n_embd=512, fast_attention=fast)
+    return GPT(mconf)
+
+
+def rss_mb(field):
+    # VmRSS (current) or VmHWM (peak) of this process, Linux only
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    # makes VmHWM restart from the current resident size, importing torch alone peaks higher than a forward pass
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def saved_activations_mb(model, x, y):
+    # memory kept alive for the backward pass by one training forward, parameters excluded
+    params = set(p.data_ptr() for p in model.parameters())
+    seen = {}
+
+    def pack(t):
+        if t.data_ptr() not in params:
+            seen[(t.data_ptr(), t.numel())] = t.numel() * t.element_size()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        model(x, y)
+    return sum(seen.values()) / 2 ** 20
+
+
+def measure(fast, mode, batch_size, steps):
+    # (ms per step, peak resident memory added by the first step in MB, activations saved for backward in MB)
+    model = make_model(fast)
+    x = torch.randint(1, 61, (batch_size, 59))
+    y = torch.randint(1, 61, (batch_size, 59))
+    saved = 0.
+    if mode == "train":
+        model.train()
+        saved = saved_activations_mb(model, x, y)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+        for p in model.parameters():  # gradients and optimizer state exist before the measured step
+            p.grad = torch.zeros_like(p)
+        optimizer.step()
+
+        def step():
+            _, loss = model(x, y)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=False)
+    else:
+        model.eval()
+
+        def step():
+            with torch.no_grad():
+                model(x)
+    reset_peak_rss()
+    base = rss_mb("VmRSS")
+    step()  # also the warm-up
+    peak = rss_mb("VmHWM") - base
+    t_start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return (time.perf_counter() - t_start) / steps * 1000, peak, saved
+
+
+def check(batch_size):
+    x = torch.randint(1, 61, (batch_size, 59))
+    explicit, fast = make_model(False).eval(), make_model(True).eval()
+    with torch.no_grad():
+        a, b = explicit(x)[0], fast(x)[0]
+    return (a - b).abs().max().item()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the fused attention path on CPU')
+    parser.add_argument('--batch_size', default=64, type=int)
+    parser.add_argument('--steps', default=5, type=int)
+    parser.add_argument('--threads', default=None, type=int)
+    parser.add_argument('--child', default=None, type=str, help='internal: run one measurement, "fast:mode"')
+    args, _ = parser.parse_known_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    if args.child is not None:
+        fast, mode = args.child.split(":")
+        print(json.dumps(measure(fast == "fast", mode, args.batch_size, args.steps)))
+        sys.exit(0)
+
+    print(f"max |logits difference|: {check(8):.2e}")
+    for mode in ["eval", "train"]:
+        results = {}
+        for path in ["explicit", "fast"]:
+            cmd = [sys.executable, __file__, "--child", f"{path}:{mode}", "--batch_size", str(args.batch_size),
+                   "--steps", str(args.steps)] + (["--threads", str(args.threads)] if args.threads is not None else [])
+            results[path] = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1])
+        (t0, m0, s0), (t1, m1, s1) = results["explicit"], results["fast"]
+        print(f"{mode:5s} batch {args.batch_size}: explicit {t0:8.1f} ms, peak +{m0:7.1f} MB | "
+              f"fast {t1:8.1f} ms, peak +{m1:7.1f} MB | {t0 / t1:.2f}x faster")
+        if mode == "train":
+            print(f"      activations saved for backward: explicit {s0:.1f} MB, fast {s1:.1f} MB")
@@ -0,0 +1,66 @@
+"""
+Check the KV cache of GPT.forward (past_key_values / use_cache) against the full forward pass, for the fused and the
+explicit attention paths: logits of every position fed one token at a time, or in uneven chunks, must match the
+logits of a single forward over the whole sequence, and greedy sampling must produce the same games.
+Then report how long mingpt.utils.sample takes to extend a prefix to a full game with and without the cache.
+Usage: python bench_kv_cache.py --n_layer 8 --n_embd 512
+"""
+import time
+import argparse
+import torch
+
+from mingpt.model import GPT, GPTConfig
+from mingpt.utils import sample
+
+
+def make_model(args, fast):
+    torch.manual_seed(args.seed)
+    mconf = GPTConfig(61, 59, n_layer=args.n_layer, n_head=args.n_head, n_embd=args.n_embd, fast_attention=fast)
+    return GPT(mconf).eval()
+
+
+@torch.no_grad()
+def check(model, x, chunks):
+    # max |difference| between the logits of one full forward and of x fed in chunks of the given sizes
+    full, _ = model(x)
+    past, pieces, start = None, [], 0
+    for size in chunks:
+        logits, _, past = model(x[:, start:start + size], past_key_values=past, use_cache=True)
+        pieces.append(logits)
+        start += size
+    return (full - torch.cat(pieces, dim=1)).abs().max().item()
+
+
+def bench(model, x, steps, use_cache):
+    t_start = time.perf_counter()
+    y = sample(model, x, steps, use_cache=use_cache)
+    return y, time.perf_counter() - t_start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check and benchmark the KV cache of GPT')
+    parser.add_argument('--n_layer', default=8, type=int)
+    parser.add_argument('--n_head', default=8, type=int)
+    parser.add_argument('--n_embd', default=512, type=int)
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--prefix', default=1, type=int, help='tokens given before sampling the rest of the game')
+    parser.add_argument('--seed', default=0, type=int)
+    args, _ = parser.parse_known_args()
+
+    x = torch.randint(1, 61, (args.batch_size, 59))
+    for fast in [True, False]:
+        model = make_model(args, fast)
+        one_by_one = check(model, x, [1] * 59)
+        uneven = check(model, x, [5, 1, 17, 2, 34])
+        print(f"{'fused' if fast else 'explicit'} attention: max |logits difference| {one_by_one:.2e} one token at a time, "
+              f"{uneven:.2e} in uneven chunks")
+        assert one_by_one < 1e-4 and uneven < 1e-4
+
+    model = make_model(args, True)
+    prefix = x[:, :args.prefix]
+    steps = 59 - args.prefix
+    y_full, t_full = bench(model, prefix, steps, use_cache=False)
+    y_cache, t_cache = bench(model, prefix, steps, use_cache=True)
+    assert torch.equal(y_full, y_cache), "greedy samples differ"
+    print(f"sample {steps} steps, batch {args.batch_size}: full recompute {t_full:.2f} s, KV cache {t_cache:.2f} s "
+          f"({t_full / t_cache:.1f}x), identical greedy games")
@@ -0,0 +1,57 @@
+"""
+Check legal-move-masked decoding (mingpt.utils.sample with legal_only): every game sampled from a prefix must replay
+on the board engine without an illegal move, greedily and with sampling, and games that end early are padded.
+Then report how often free sampling proposes an illegal move, i.e. how much a rejection loop would waste.
+Usage: python bench_legal_decoding.py --ckpt ./ckpts/gpt_synthetic.ckpt
+"""
+import time
+import argparse
+import numpy as np
+import torch
+
+from data.othello import BatchedOthelloBoards, generate_random_games, NOT_A_MOVE
+from data.tokenizer import OthelloTokenizer
+from mingpt.model import GPT, GPTConfig
+from mingpt.utils import sample
+
+
+def count_illegal(tokenizer, x):
+    # illegal moves in [B, T] token sequences, padding after the end of a game is fine
+    moves = tokenizer.decode(x.cpu().numpy())
+    boards = BatchedOthelloBoards(len(moves))
+    illegal = 0
+    for t in range(moves.shape[1]):
+        illegal += int(((moves[:, t] >= 0) & (boards.try_umpire(moves[:, t]) == NOT_A_MOVE)).sum())
+    return illegal
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check legal-move-masked decoding')
+    parser.add_argument('--ckpt', default=None, type=str, help='random weights if not given')
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--prefix', default=10, type=int, help='moves of random games given before sampling')
+    parser.add_argument('--seed', default=0, type=int)
+    args, _ = parser.parse_known_args()
+
+    torch.manual_seed(args.seed)
+    tokenizer = OthelloTokenizer.for_checkpoint(args.ckpt) if args.ckpt else OthelloTokenizer()
+    model = GPT(GPTConfig(tokenizer.vocab_size, tokenizer.block_size, n_layer=8, n_head=8, n_embd=512))
+    if args.ckpt:
+        model.load_state_dict(torch.load(args.ckpt, map_location="cpu"))
+    model.eval()
+
+    moves, lengths = generate_random_games(args.batch_size, np.random.default_rng(args.seed))
+    x = tokenizer.encode(moves[:, :args.prefix].astype(np.int64))
+    x = torch.from_numpy(x)
+    steps = tokenizer.block_size - args.prefix
+    for name, kwargs in [("greedy", {}), ("sampled", {"sample": True, "top_k": 10})]:
+        t_start = time.perf_counter()
+        y_free = sample(model, x, steps, **kwargs)
+        t_free = time.perf_counter() - t_start
+        t_start = time.perf_counter()
+        y_legal = sample(model, x, steps, legal_only=True, tokenizer=tokenizer, **kwargs)
+        t_legal = time.perf_counter() - t_start
+        assert count_illegal(tokenizer, y_legal) == 0, "masked decoding produced an illegal move"
+        free = count_illegal(tokenizer, y_free)
+        print(f"{name:8s}: free {free}/{y_free[:, args.prefix:].numel()} illegal moves ({t_free:.2f} s), "
+              f"masked 0 illegal moves ({t_legal:.2f} s)")
@@ -0,0 +1,157 @@
+"""
+Compare the bitboard OthelloBoardState in data/othello.py against the original array-walking implementation:
+check that both produce identical states, ages and legal moves on random games, then report moves per second.
+Also reports how many games per second BatchedOthelloBoards labels with the full ground truth.
+Usage: python bench_othello_engine.py --games 200
+"""
+import time
+import random
+import argparse
+import numpy as np
+
+from data.othello import OthelloBoardState, BatchedOthelloBoards, eights
+
+
+class ReferenceOthelloBoardState():
+    # the original implementation of data.othello.OthelloBoardState, kept only for comparison
+    def __init__(self, ):
+        self.state = np.zeros((8, 8))
+        self.state[3, 4] = 1
+        self.state[3, 3] = -1
+        self.state[4, 3] = 1
+        self.state[4, 4] = -1
+        self.age = np.zeros((8, 8))
+        self.next_hand_color = 1
+
+    def get_state(self, ):
+        return (self.state + 1).flatten().tolist()
+
+    def get_age(self, ):
+        return self.age.flatten().tolist()
+
+    def _scan(self, r, c, color):
+        tbf = []
+        for direction in eights:
+            buffer = []
+            cur_r, cur_c = r, c
+            while 1:
+                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
+                if cur_r < 0 or cur_r > 7 or cur_c < 0 or cur_c > 7:
+                    break
+                if self.state[cur_r, cur_c] == 0:
+                    break
+                elif self.state[cur_r, cur_c] == color:
+                    tbf.extend(buffer)
+                    break
+                else:
+                    buffer.append([cur_r, cur_c])
+        return tbf
+
+    def umpire(self, move):
+        r, c = move // 8, move % 8
+        assert self.state[r, c] == 0, f"{r}-{c} is already occupied!"
+        color = self.next_hand_color
+        tbf = self._scan(r, c, color)
+        if len(tbf) == 0:
+            color *= -1
+            self.next_hand_color *= -1
+            tbf = self._scan(r, c, color)
+        assert len(tbf) != 0, "Illegal move!"
+        self.age += 1
+        for ff in tbf:
+            self.state[ff[0], ff[1]] *= -1
+            self.age[ff[0], ff[1]] = 0
+        self.state[r, c] = color
+        self.age[r, c] = 0
+        self.next_hand_color *= -1
+
+    def tentative_move(self, move):
+        r, c = move // 8, move % 8
+        if not self.state[r, c] == 0:
+            return 0
+        if len(self._scan(r, c, self.next_hand_color)):
+            return 1
+        elif len(self._scan(r, c, -self.next_hand_color)):
+            return 2
+        return 0
+
+    def get_valid_moves(self, ):
+        regular_moves, forfeit_moves = [], []
+        for move in range(64):
+            x = self.tentative_move(move)
+            if x == 1:
+                regular_moves.append(move)
+            elif x == 2:
+                forfeit_moves.append(move)
+        return regular_moves if len(regular_moves) else forfeit_moves
+
+
+def random_game(board_cls, rng):
+    # play uniformly random legal moves until nobody can move, same procedure as data.othello.get_ood_game
+    tbr = []
+    ab = board_cls()
+    possible_next_steps = ab.get_valid_moves()
+    while possible_next_steps:
+        next_step = rng.choice(possible_next_steps)
+        tbr.append(next_step)
+        ab.umpire(next_step)
+        possible_next_steps = ab.get_valid_moves()
+    return tbr
+
+
+def check(games):
+    for game in games:
+        ref, new = ReferenceOthelloBoardState(), OthelloBoardState()
+        assert ref.get_valid_moves() == new.get_valid_moves()
+        for move in game:
+            ref.umpire(move)
+            new.umpire(move)
+            assert ref.get_state() == new.get_state()
+            assert ref.get_age() == new.get_age()
+            assert ref.next_hand_color == new.next_hand_color
+            assert ref.get_valid_moves() == new.get_valid_moves()
+
+
+def bench(board_cls, games):
+    # replay every game, asking for the legal moves after each ply like get_ood_game does
+    num_moves = 0
+    t_start = time.perf_counter()
+    for game in games:
+        ab = board_cls()
+        ab.get_valid_moves()
+        for move in game:
+            ab.umpire(move)
+            ab.get_valid_moves()
+        num_moves += len(game)
+    return num_moves / (time.perf_counter() - t_start)
+
+
+def bench_batched(games, copies):
+    # ground truth (state, age, legal moves, next player) for copies * len(games) games replayed in lockstep
+    moves = np.full((len(games), 60), -100)
+    for i, game in enumerate(games):
+        moves[i, :len(game)] = game
+    moves = np.tile(moves, (copies, 1))
+    t_start = time.perf_counter()
+    BatchedOthelloBoards(len(moves)).get_all_gt(moves)
+    return len(moves) / (time.perf_counter() - t_start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Othello board engine')
+    parser.add_argument('--games', default=200, type=int)
+    parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--batch_copies', default=100, type=int)
+    args, _ = parser.parse_known_args()
+
+    rng = random.Random(args.seed)
+    games = [random_game(OthelloBoardState, rng) for _ in range(args.games)]
+    check(games)
+    print(f"Identical states, ages and legal moves on {len(games)} random games")
+
+    ref_speed = bench(ReferenceOthelloBoardState, games)
+    new_speed = bench(OthelloBoardState, games)
+    print(f"reference: {ref_speed:10.0f} moves/s")
+    print(f"bitboard:  {new_speed:10.0f} moves/s ({new_speed / ref_speed:.1f}x)")
+    batched_speed = bench_batched(games, args.batch_copies)
+    print(f"batched ground truth: {batched_speed:10.0f} games/s")
@@ -0,0 +1,195 @@
+import numpy as np
+
+# Bitboard primitives for 8x8 Othello.
+# A board is two python ints used as 64-bit occupancy masks, one per color, where bit r * 8 + c
+# is set iff square (r, c) holds a disc of that color (same indexing as permit/permit_reverse).
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))  # column 0
+FILE_H = FILE_A << 7  # column 7
+NOT_A = FULL & ~FILE_A
+NOT_H = FULL & ~FILE_H
+
+INITIAL_BLACK = (1 << 28) | (1 << 35)  # d5 and e4
+INITIAL_WHITE = (1 << 27) | (1 << 36)  # d4 and e5
+
+# (shift, mask) for every direction in data.othello.eights, the mask drops discs that wrapped around a file edge
+# positive shifts go towards higher square indices (<<), negative ones towards lower (>>)
+DIRECTIONS = [(-8, FULL), (-7, NOT_A), (1, NOT_A), (9, NOT_A), (8, FULL), (7, NOT_H), (-1, NOT_H), (-9, NOT_H)]
+_LEFT = [(n, m) for n, m in DIRECTIONS if n > 0]
+_RIGHT = [(-n, m) for n, m in DIRECTIONS if n < 0]
+
+
+def shift(b, n, m):
+    # move every disc of b one step in the direction (n, m) of DIRECTIONS
+    return ((b << n) if n > 0 else (b >> -n)) & m
+
+
+def popcount(b):
+    return bin(b).count("1")
+
+
+def squares(b):
+    # indices of the set bits of b, in increasing order
+    tbr = []
+    while b:
+        low = b & -b
+        tbr.append(low.bit_length() - 1)
+        b ^= low
+    return tbr
+
+
+def get_flips(own, opp, square):
+    # discs of opp that get flipped when own drops a piece on square, 0 if that is not a legal move for own
+    flipped = 0
+    bit = 1 << square
+    for n, m in _LEFT:
+        x = (bit << n) & m
+        line = 0
+        while x & opp:
+            line |= x
+            x = (x << n) & m
+        if x & own:
+            flipped |= line
+    for n, m in _RIGHT:
+        x = (bit >> n) & m
+        line = 0
+        while x & opp:
+            line |= x
+            x = (x >> n) & m
+        if x & own:
+            flipped |= line
+    return flipped
+
+
+def get_flips_both(own, opp, square):
+    # (get_flips(own, opp, square), get_flips(opp, own, square)) with a single walk per direction:
+    # a run of opp discs closed by an own disc flips for own, a run of own discs closed by an opp disc flips for opp
+    own_flips, opp_flips = 0, 0
+    bit = 1 << square
+    for n, m in _LEFT:
+        x = (bit << n) & m
+        line = 0
+        if x & opp:
+            while x & opp:
+                line |= x
+                x = (x << n) & m
+            if x & own:
+                own_flips |= line
+        elif x & own:
+            while x & own:
+                line |= x
+                x = (x << n) & m
+            if x & opp:
+                opp_flips |= line
+    for n, m in _RIGHT:
+        x = (bit >> n) & m
+        line = 0
+        if x & opp:
+            while x & opp:
+                line |= x
+                x = (x >> n) & m
+            if x & own:
+                own_flips |= line
+        elif x & own:
+            while x & own:
+                line |= x
+                x = (x >> n) & m
+            if x & opp:
+                opp_flips |= line
+    return own_flips, opp_flips
+
+
+def get_moves(own, opp):
+    # every square where own can drop a piece, all directions at once: grow runs of opp discs
+    # starting next to own discs (at most 6 long on an 8x8 board), a move is the empty square right after a run
+    empty = FULL & ~(own | opp)
+    moves = 0
+    for n, m in _LEFT:
+        om = opp & m
+        x = (own << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        moves |= (x << n) & m
+    for n, m in _RIGHT:
+        om = opp & m
+        x = (own >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        moves |= (x >> n) & m
+    return moves & empty
+
+
+# numpy counterparts of the above working on uint64 arrays of boards, one board per entry
+_LEFT_U64 = [(np.uint64(n), np.uint64(m)) for n, m in _LEFT]
+_RIGHT_U64 = [(np.uint64(n), np.uint64(m)) for n, m in _RIGHT]
+
+
+def get_flips_batch(own, opp, bit):
+    # same as get_flips for a whole batch, bit is a uint64 array with the single bit of the square played in each game
+    flipped = np.zeros_like(own)
+    for n, m in _LEFT_U64:
+        om = opp & m
+        x = (bit << n) & om
+        for _ in range(5):
+            x |= (x << n) & om
+        flipped |= np.where((x << n) & m & own, x, 0)
+    for n, m in _RIGHT_U64:
+        om = opp & m
+        x = (bit >> n) & om
+        for _ in range(5):
+            x |= (x >> n) & om
+        flipped |= np.where((x >> n) & m & own, x, 0)
+    return flipped
+
+
+def get_moves_batch(own, opp):
+    # same as get_moves for a whole batch
+    empty = ~(own | opp)
+    moves = np.zeros_like(own)
+    for n, m in _LEFT_U64:
+        om = opp & m
+        x = (own << n) & om
+        for _ in range(5):
+            x |= (x << n) & om
+        moves |= (x << n) & m
+    for n, m in _RIGHT_U64:
+        om = opp & m
+        x = (own >> n) & om
+        for _ in range(5):
+            x |= (x >> n) & om
+        moves |= (x >> n) & m
+    return moves & empty
+
+
+def unpack_batch(b):
+    # [N] uint64 -> [N, 64] boolean array, True where the bit is set
+    b = np.ascontiguousarray(b, dtype="<u8")
+    return np.unpackbits(b.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little").astype(bool)
+
+
+def to_bool_array(b):
+    # [64] boolean array, True where the bit is set
+    bits = np.frombuffer(b.to_bytes(8, "little"), dtype=np.uint8)
+    return np.unpackbits(bits, bitorder="little").astype(bool)
+
+
+def to_array(black, white, dtype=float):
+    # 8x8 array with 1 for black, -1 for white and 0 for blank
+    bits = np.frombuffer(black.to_bytes(8, "little") + white.to_bytes(8, "little"), dtype=np.uint8)
+    bits = np.unpackbits(bits, bitorder="little").reshape(2, 8, 8).astype(dtype)
+    return bits[0] - bits[1]
+
+
+def from_array(board):
+    # inverse of to_array, takes anything shaped like an 8x8 board of 1 / 0 / -1
+    board = np.asarray(board).reshape(-1)
+    black = int.from_bytes(np.packbits(board == 1, bitorder="little").tobytes(), "little")
+    white = int.from_bytes(np.packbits(board == -1, bitorder="little").tobytes(), "little")
+    return black, white
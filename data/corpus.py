@@ -0,0 +1,235 @@
+import os
+import json
+import glob
+import pickle
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+# Columnar on-disk format for game corpora, replacing pickled lists of lists.
+# A corpus is a directory with an index.json and one or more shard files. Each shard is
+#   header: 32 bytes, MAGIC, then version, number of games and width as little-endian uint32 / uint64 / uint32
+#   moves: [N, WIDTH] uint8, one game per row, padded with PAD after its last move
+#   lengths: [N] uint8, number of moves of every game
+# so both columns can be opened with np.memmap without reading the file. index.json lists the shards in order with
+# their number of games and the global index of their first game, and whether the corpus holds deduplicated games:
+# data/dedup.py sets "deduplicated", any shard appended afterwards by a CorpusWriter clears it.
+
+MAGIC = b"OTHGAMES"
+VERSION = 1
+WIDTH = 60
+PAD = 255
+HEADER_SIZE = 32
+INDEX = "index.json"
+
+
+def pack_games(games):
+    # list of move lists -> ([N, WIDTH] uint8 moves, [N] uint8 lengths)
+    moves = np.full((len(games), WIDTH), PAD, dtype=np.uint8)
+    lengths = np.zeros(len(games), dtype=np.uint8)
+    for i, game in enumerate(games):
+        moves[i, :len(game)] = game
+        lengths[i] = len(game)
+    return moves, lengths
+
+
+def write_shard(fn, moves, lengths):
+    header = MAGIC + np.array([VERSION], dtype="<u4").tobytes() + np.array([len(moves)], dtype="<u8").tobytes() \
+        + np.array([WIDTH], dtype="<u4").tobytes()
+    with open(fn, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(moves, dtype=np.uint8).tobytes())
+        f.write(np.ascontiguousarray(lengths, dtype=np.uint8).tobytes())
+
+
+def open_shard(fn):
+    # memory-mapped ([N, WIDTH] moves, [N] lengths) of a shard
+    with open(fn, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    assert header[:8] == MAGIC, f"{fn} is not a game shard"
+    version = int(np.frombuffer(header[8:12], dtype="<u4")[0])
+    num_games = int(np.frombuffer(header[12:20], dtype="<u8")[0])
+    width = int(np.frombuffer(header[20:24], dtype="<u4")[0])
+    assert version == VERSION, f"{fn} has format version {version}, expected {VERSION}"
+    if num_games == 0:
+        return np.zeros((0, width), dtype=np.uint8), np.zeros(0, dtype=np.uint8)
+    moves = np.memmap(fn, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(num_games, width))
+    lengths = np.memmap(fn, dtype=np.uint8, mode="r", offset=HEADER_SIZE + num_games * width, shape=(num_games, ))
+    return moves, lengths
+
+
+def is_corpus(root):
+    return os.path.exists(os.path.join(root, INDEX))
+
+
+def read_index(root):
+    if not is_corpus(root):
+        return {"version": VERSION, "width": WIDTH, "num_games": 0, "shards": []}
+    with open(os.path.join(root, INDEX), "r") as f:
+        return json.load(f)
+
+
+def write_index(root, index):
+    with open(os.path.join(root, INDEX), "w") as f:
+        json.dump(index, f, indent=1)
+
+
+def is_deduplicated(root):
+    # whether every game of the corpus root is unique, i.e. it was written by data/dedup.py and not appended to since
+    return read_index(root).get("deduplicated", False)
+
+
+class CorpusWriter():
+    # streams games into fixed-size shards of a corpus directory, appending to the shards already indexed there
+    # sync_index: rewrite index.json after every shard, so a crash loses at most the buffered games; when False the
+    # index is only written by close() and an interrupted run leaves no corpus behind
+    def __init__(self, root, shard_size=100000, prefix="shard", sync_index=True):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.sync_index = sync_index
+        self.index = read_index(root)
+        self.buffer = []  # packed (moves, lengths) chunks not written yet
+        self.num_buffered = 0
+
+    def _write_index(self, ):
+        write_index(self.root, self.index)
+
+    def _flush(self, num_games):
+        moves = np.concatenate([m for m, _ in self.buffer])
+        lengths = np.concatenate([l for _, l in self.buffer])
+        self.buffer = [(moves[num_games:], lengths[num_games:])]
+        self.num_buffered -= num_games
+        fn = f"{self.prefix}_{len(self.index['shards']):05d}.games"
+        write_shard(os.path.join(self.root, fn), moves[:num_games], lengths[:num_games])
+        self.index["shards"].append({"file": fn, "num_games": num_games, "start": self.index["num_games"]})
+        self.index["num_games"] += num_games
+        self.index["deduplicated"] = False  # new games may repeat the ones already there
+        if self.sync_index:
+            self._write_index()
+
+    def extend(self, games):
+        self.extend_packed(*pack_games(games))
+
+    def extend_packed(self, moves, lengths):
+        # same as extend for games already packed as ([N, WIDTH] moves, [N] lengths)
+        self.buffer.append((np.asarray(moves, dtype=np.uint8), np.asarray(lengths, dtype=np.uint8)))
+        self.num_buffered += len(lengths)
+        while self.num_buffered >= self.shard_size:
+            self._flush(self.shard_size)
+
+    def close(self, ):
+        if self.num_buffered:
+            self._flush(self.num_buffered)
+        self.buffer = []
+        self._write_index()
+        return self.index["num_games"]
+
+
+class GameCorpus():
+    # all the games of a corpus directory, memory-mapped: opening it reads only index.json and the shard headers
+    # supports len() and [i] -> list of moves like the list of lists it replaces; view(start, stop), slicing,
+    # shuffled(seed) and split(sizes, seed) give views sharing the memory maps, a view over a permutation holds one
+    # index per game and nothing else
+    def __init__(self, root):
+        self.root = root
+        self.index = read_index(root)
+        self.shards = [open_shard(os.path.join(root, s["file"])) for s in self.index["shards"]]
+        self.starts = np.array([s["start"] for s in self.index["shards"]] + [self.index["num_games"]], dtype=np.int64)
+        self.indices = None  # global game indices of this view, None for the range start, ..., stop - 1
+        self.start, self.stop = 0, self.index["num_games"]
+
+    def __len__(self, ):
+        return self.stop - self.start
+
+    def _global(self, i):
+        # global indices of the games i ([B] array) of this view
+        i = np.asarray(i, dtype=np.int64)
+        return i + self.start if self.indices is None else self.indices[i + self.start].astype(np.int64)
+
+    def _locate(self, i):
+        # (shard, row in shard) of the i-th game of this view
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"game {i} out of range for a corpus of {len(self)} games")
+        i = int(self._global(i))
+        s = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return s, i - int(self.starts[s])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            assert step == 1, "only contiguous slices of a corpus are supported"
+            return self.view(start, stop)
+        s, j = self._locate(i)
+        moves, lengths = self.shards[s]
+        return moves[j, :lengths[j]].tolist()
+
+    def __iter__(self, ):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _derive(self, indices, start, stop):
+        tbr = GameCorpus.__new__(GameCorpus)
+        tbr.root, tbr.index, tbr.shards, tbr.starts = self.root, self.index, self.shards, self.starts
+        tbr.indices, tbr.start, tbr.stop = indices, start, stop
+        return tbr
+
+    def view(self, start, stop=None):
+        # the games [start, stop) of this corpus, sharing its memory maps (and index array, if any)
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        return self._derive(self.indices, self.start + start, self.start + stop)
+
+    def shuffled(self, seed):
+        # the games of this view in an order drawn from seed
+        perm = np.random.default_rng(seed).permutation(len(self))
+        dtype = np.uint32 if self.index["num_games"] < 2 ** 32 else np.int64
+        return self._derive(self._global(perm).astype(dtype), 0, len(self))
+
+    def split(self, sizes, seed=None):
+        # consecutive views of sizes[0], sizes[1], ... games, a None size takes what is left (at most one of them);
+        # with a seed the games are shuffled first, so every split is a random sample of the corpus
+        base = self if seed is None else self.shuffled(seed)
+        assert sum(s is None for s in sizes) <= 1, "at most one split can take the rest"
+        rest = max(len(base) - sum(s for s in sizes if s is not None), 0)
+        tbr, start = [], 0
+        for size in sizes:
+            stop = start + (rest if size is None else size)
+            tbr.append(base.view(start, stop))
+            start = min(stop, len(base))
+        return tbr
+
+    def get_batch(self, indices):
+        # ([B, WIDTH] moves padded with PAD, [B] lengths) for game indices of this view, shard by shard
+        indices = self._global(indices)
+        shard_ids = np.searchsorted(self.starts, indices, side="right") - 1
+        moves = np.empty((len(indices), self.index["width"]), dtype=np.uint8)
+        lengths = np.empty(len(indices), dtype=np.uint8)
+        for s in np.unique(shard_ids):
+            sel = shard_ids == s
+            rows = indices[sel] - self.starts[s]
+            moves[sel] = self.shards[s][0][rows]
+            lengths[sel] = self.shards[s][1][rows]
+        return moves, lengths
+
+
+def convert_pickles(src, dst, shard_size=100000):
+    # turn a folder of pickled lists of games (the old synthetic format) into a corpus, one pickle in memory at a time
+    writer = CorpusWriter(dst, shard_size=shard_size)
+    for fn in tqdm(sorted(glob.glob(os.path.join(src, "*.pickle")))):
+        with open(fn, "rb") as handle:
+            writer.extend(pickle.load(handle))
+    return writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert pickled Othello games to the columnar corpus format')
+    parser.add_argument('--src', default="./data/othello_synthetic", type=str)
+    parser.add_argument('--dst', default="./data/othello_synthetic_corpus", type=str)
+    parser.add_argument('--shard_size', default=100000, type=int)
+    args, _ = parser.parse_known_args()
+    num_games = convert_pickles(args.src, args.dst, args.shard_size)
+    print(f"{num_games} games in {args.dst}")
@@ -0,0 +1,234 @@
+import os
+import glob
+import json
+import pickle
+import shutil
+import tempfile
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from .corpus import CorpusWriter, GameCorpus, is_corpus, is_deduplicated, pack_games, read_index, write_index, INDEX, WIDTH, PAD
+
+# External-memory deduplication of a game corpus. Sorting the whole corpus as Python lists needs several times its
+# size in RAM; here memory is bounded by the size of one shard plus one hash bucket, however many shards there are:
+#   1. the games of every source chunk are deduplicated among themselves, then hashed and appended, with their global
+#      index and number of copies, to one of several bucket files on disk chosen by the top bits of the hash, so
+#      identical games always land in the same bucket and a game appears at most once per chunk there
+#   2. buckets are deduplicated one at a time by comparing the packed rows themselves (the hash only partitions, a
+#      collision costs nothing); a bucket larger than max_bucket_games is split again on the next bits of the hash
+#   3. the indices of the duplicates, sorted, are kept per bucket on disk, and the source is streamed a second time
+#      into the output corpus, dropping them; the first occurrence of every game is kept, in the original order
+# The output index.json is marked "deduplicated" and records what the source looked like ("source"), so that
+# is_up_to_date tells whether games were added to the source since and the dedup has to run again.
+
+RECORD = np.dtype([("hash", "<u8"), ("index", "<i8"), ("count", "<u4"), ("moves", "u1", (WIDTH, ))])
+FANOUT_BITS = 4  # a bucket that is too large is split 16 ways
+STATS = "dedup_stats.json"
+
+
+def hash_rows(moves):
+    # [N] uint64 hash of packed [N, WIDTH] uint8 rows, vectorized (only used to partition, not to compare)
+    words = np.zeros((len(moves), 64), dtype=np.uint8)
+    words[:, :WIDTH] = moves
+    words = words.view("<u8")
+    h = np.full(len(moves), 0xcbf29ce484222325, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for k in range(words.shape[1]):
+            h = (h ^ words[:, k]) * np.uint64(0x100000001b3)
+            h ^= h >> np.uint64(29)
+    return h
+
+
+def unique_rows(moves):
+    # (index of the first occurrence, number of copies, inverse) of every distinct row of [N, WIDTH] uint8 moves
+    rows = np.ascontiguousarray(moves).view(np.dtype((np.void, WIDTH))).ravel()
+    _, first, inverse, counts = np.unique(rows, return_index=True, return_inverse=True, return_counts=True)
+    return first, counts, inverse
+
+
+def as_folders(src):
+    # src: a folder or a list of folders
+    return [src] if isinstance(src, str) else list(src)
+
+
+def pickle_files(folder):
+    return sorted(glob.glob(os.path.join(folder, "*.pickle")))
+
+
+def iter_chunks(src, min_games=0):
+    # packed ([N, WIDTH] moves, [N] lengths) chunks of every folder of src, in order: the pickles of the folder, one
+    # chunk per file, then its corpus shards, one chunk per shard (a folder may hold both, e.g. downloaded pickles and
+    # shards written next to them by a CorpusWriter)
+    # min_games: pickles with fewer games are skipped, they are leftovers of interrupted generation runs
+    for folder in as_folders(src):
+        for fn in pickle_files(folder):
+            with open(fn, "rb") as handle:
+                games = pickle.load(handle)
+            if len(games) < min_games:
+                continue
+            yield pack_games(games)
+        if is_corpus(folder):
+            for moves, lengths in GameCorpus(folder).shards:
+                yield moves, lengths
+
+
+def source_signature(src):
+    # what iter_chunks(src) reads, per folder: its pickles and its corpus shards (only ever appended)
+    signature = []
+    for folder in as_folders(src):
+        fns = pickle_files(folder)
+        index = read_index(folder)
+        signature.append({"folder": os.path.abspath(folder), "num_pickles": len(fns),
+                          "num_bytes": sum(os.path.getsize(fn) for fn in fns),
+                          "num_games": index["num_games"], "num_shards": len(index["shards"])})
+    return signature
+
+
+def is_up_to_date(src, dst):
+    # whether the corpus dst holds the unique games of src as it is now
+    return is_deduplicated(dst) and read_index(dst).get("source") == source_signature(src)
+
+
+def clear_corpus(root):
+    # removes the shards and index of the corpus root, anything else in the folder (e.g. pickles) stays
+    for shard in read_index(root)["shards"]:
+        os.remove(os.path.join(root, shard["file"]))
+    for fn in [INDEX, STATS]:
+        if os.path.exists(os.path.join(root, fn)):
+            os.remove(os.path.join(root, fn))
+
+
+class BucketFiles():
+    # append-only files of RECORD rows, one per bucket
+    def __init__(self, root, num_buckets):
+        self.fns = [os.path.join(root, f"bucket_{i:05d}.bin") for i in range(num_buckets)]
+        self.files = [open(fn, "wb") for fn in self.fns]
+
+    def append(self, records, buckets):
+        order = np.argsort(buckets, kind="stable")  # keeps global order within every bucket
+        records, buckets = records[order], buckets[order]
+        bounds = np.searchsorted(buckets, np.arange(len(self.files) + 1))
+        for i in range(len(self.files)):
+            if bounds[i] < bounds[i + 1]:
+                self.files[i].write(records[bounds[i]:bounds[i + 1]].tobytes())
+
+    def close(self, ):
+        for f in self.files:
+            f.close()
+        return self.fns
+
+
+def dedup_bucket(fn, shift, max_bucket_games, stats, drop_fns):
+    # dedup one bucket file, splitting it on the next FANOUT_BITS of the hash if it is too large
+    num_records = os.path.getsize(fn) // RECORD.itemsize
+    if num_records > max_bucket_games and shift >= FANOUT_BITS:
+        shift -= FANOUT_BITS
+        sub = BucketFiles(tempfile.mkdtemp(dir=os.path.dirname(fn)), 2 ** FANOUT_BITS)
+        records = np.memmap(fn, dtype=RECORD, mode="r")
+        for start in range(0, num_records, max_bucket_games):
+            chunk = np.array(records[start:start + max_bucket_games])
+            sub.append(chunk, ((chunk["hash"] >> np.uint64(shift)) & np.uint64(2 ** FANOUT_BITS - 1)).astype(np.int64))
+        del records
+        os.remove(fn)
+        for sub_fn in sub.close():
+            dedup_bucket(sub_fn, shift, max_bucket_games, stats, drop_fns)
+        return
+    records = np.fromfile(fn, dtype=RECORD)
+    os.remove(fn)
+    if len(records) == 0:
+        return
+    first, _, inverse = unique_rows(records["moves"])  # first occurrence, records are in global order
+    counts = np.bincount(inverse.ravel(), weights=records["count"]).astype(np.int64)
+    for k, v in zip(*np.unique(counts, return_counts=True)):
+        stats["multiplicity"][int(k)] = stats["multiplicity"].get(int(k), 0) + int(v)
+    lengths = (records["moves"][first] != PAD).sum(axis=1)
+    np.add.at(stats["duplicates_by_length"], lengths, counts - 1)
+    dup = np.ones(len(records), dtype=bool)
+    dup[first] = False
+    save_drops(fn[:-len(".bin")] + ".drop.npy", records["index"][dup], drop_fns)
+
+
+def save_drops(fn, indices, drop_fns):
+    if len(indices):
+        np.save(fn, np.sort(indices))
+        drop_fns.append(fn)
+
+
+def dedup_corpus(src, dst, shard_size=100000, max_bucket_games=1000000, min_games=0, tmp_dir=None):
+    # write the unique games of src (folders of pickles and / or corpus shards, see iter_chunks) to the corpus dst,
+    # replacing whatever corpus was there, returns the statistics that are also saved as dst/dedup_stats.json
+    assert all(os.path.abspath(folder) != os.path.abspath(dst) for folder in as_folders(src)), "cannot dedup in place"
+    os.makedirs(dst, exist_ok=True)
+    clear_corpus(dst)
+    signature = source_signature(src)
+    tmp = tempfile.mkdtemp(prefix=".dedup_", dir=dst if tmp_dir is None else tmp_dir)
+    try:
+        num_games = sum(read_index(folder)["num_games"] for folder in as_folders(src))  # pickles not counted
+        bits = max(FANOUT_BITS, int(np.ceil(np.log2(max(num_games / max_bucket_games, 1)))) + 1)
+        buckets = BucketFiles(tmp, 2 ** bits)
+        drop_fns = []
+        num_games = 0
+        for moves, lengths in tqdm(iter_chunks(src, min_games), desc="Partitioning"):
+            first, counts, _ = unique_rows(moves)
+            order = np.argsort(first)  # distinct games of the chunk, in order of first occurrence
+            dup = np.ones(len(lengths), dtype=bool)
+            dup[first] = False
+            save_drops(os.path.join(tmp, f"chunk_{num_games}.drop.npy"), np.flatnonzero(dup) + num_games, drop_fns)
+            records = np.empty(len(first), dtype=RECORD)
+            records["moves"] = moves[first[order]]
+            records["count"] = counts[order]
+            records["hash"] = hash_rows(records["moves"])
+            records["index"] = first[order] + num_games
+            buckets.append(records, (records["hash"] >> np.uint64(64 - bits)).astype(np.int64))
+            num_games += len(lengths)
+        stats = {"multiplicity": {}, "duplicates_by_length": np.zeros(WIDTH + 1, dtype=np.int64)}
+        for fn in tqdm(buckets.close(), desc="Deduplicating"):
+            dedup_bucket(fn, 64 - bits, max_bucket_games, stats, drop_fns)
+
+        drops = [np.load(fn, mmap_mode="r") for fn in drop_fns]
+        writer = CorpusWriter(dst, shard_size=shard_size, sync_index=False)
+        start = 0
+        for moves, lengths in tqdm(iter_chunks(src, min_games), desc="Writing"):
+            stop = start + len(lengths)
+            keep = np.ones(len(lengths), dtype=bool)
+            for d in drops:
+                keep[d[np.searchsorted(d, start):np.searchsorted(d, stop)] - start] = False
+            writer.extend_packed(moves[keep], lengths[keep])
+            start = stop
+        num_unique = writer.close()
+        del drops
+        index = read_index(dst)
+        index["deduplicated"] = True
+        index["source"] = signature
+        write_index(dst, index)
+    finally:
+        shutil.rmtree(tmp)
+
+    stats = {
+        "num_games": num_games,
+        "num_unique": num_unique,
+        "num_duplicates": num_games - num_unique,
+        "duplicate_rate": (num_games - num_unique) / max(num_games, 1),
+        "max_multiplicity": max(stats["multiplicity"], default=0),
+        "multiplicity": dict(sorted(stats["multiplicity"].items())),  # k -> number of distinct games seen k times
+        "duplicates_by_length": {k: int(v) for k, v in enumerate(stats["duplicates_by_length"]) if v},
+    }
+    with open(os.path.join(dst, STATS), "w") as f:
+        json.dump(stats, f, indent=1)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Deduplicate an Othello game corpus with bounded memory')
+    parser.add_argument('--src', default=["./data/othello_synthetic"], type=str, nargs="+",
+                        help='folders of pickles and / or corpus shards')
+    parser.add_argument('--dst', default="./data/othello_synthetic_dedup", type=str)
+    parser.add_argument('--shard_size', default=100000, type=int)
+    parser.add_argument('--max_bucket_games', default=1000000, type=int, help='bounds the memory of the dedup pass')
+    parser.add_argument('--min_games', default=0, type=int, help='skip pickles with fewer games')
+    parser.add_argument('--tmp_dir', default=None, type=str, help='scratch space, defaults to inside dst')
+    args, _ = parser.parse_known_args()
+    stats = dedup_corpus(args.src, args.dst, args.shard_size, args.max_bucket_games, args.min_games, args.tmp_dir)
+    print(f"{stats['num_unique']}/{stats['num_games']} (unique/total) games in {args.dst}, "
+          f"{stats['duplicate_rate']:.4%} duplicates, at most {stats['max_multiplicity']} copies of a game")
@@ -1,14 +1,11 @@
 import os
-import pgn
 import numpy as np
 import random
 from tqdm import tqdm
 import time
 import multiprocessing
-import pickle
-import psutil
 import seaborn as sns
-import itertools
+import hashlib
 from copy import copy, deepcopy
 from matplotlib.patches import Rectangle, Circle
 from matplotlib.collections import PatchCollection
@@ -16,6 +13,12 @@ from matplotlib.colors import ListedColormap
 import matplotlib.patches as mpatches
 from matplotlib.colors import LinearSegmentedColormap
 
+from .bitboard import INITIAL_BLACK, INITIAL_WHITE, get_flips_both, get_moves, popcount, squares, to_array, to_bool_array, from_array
+from .bitboard import get_flips_batch, get_moves_batch, unpack_batch
+from .corpus import CorpusWriter, GameCorpus, PAD
+from .dedup import dedup_corpus, is_up_to_date
+from .pgn_cache import load_pgn_files, unpack_games
+
 rows = list("abcdefgh")
 columns = [str(_) for _ in range(1, 9)]
 
@@ -59,13 +62,21 @@ start_hands = [permit(_) for _ in ["d5", "d4", "e4", "e5"]]
 eights = [[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1]]
 
 wanna_use = "othello_synthetic"
+generated = f"{wanna_use}_generated"  # games generated locally, kept apart from the downloaded ones
+
+# status codes of OthelloBoardState.tentative_move / try_move
+NOT_A_MOVE = 0  # occupied, off the board, or neither color can flip anything there
+REGULAR_MOVE = 1
+FORFEIT_MOVE = 2  # the side to move has to pass, the opponent drops a piece there
 
 class Othello:
-    def __init__(self, ood_perc=0., data_root=None, wthor=False, ood_num=1000):
+    def __init__(self, ood_perc=0., data_root=None, wthor=False, ood_num=1000, splits=(20000000, None, 0), split_seed=None):
         # ood_perc: probability of swapping an in-distribution game (real championship game)
         # with a generated legit but stupid game, when data_root is None, should set to 0
         # data_root: if provided, will load pgn files there, else load from data/gen10e5
         # ood_num: how many simulated games to use, if -1, load 200 * 1e5 games = 20 million
+        # splits: number of train / val / test games of the synthetic corpus (ood_num == -1), None for the rest
+        # split_seed: if given, splits are drawn from a permutation of the corpus instead of consecutive ranges
         self.ood_perc = ood_perc
         self.sequences = []
         self.results = []
@@ -76,76 +87,37 @@ class Othello:
                 return
             else:
                 if ood_num != -1:  # this setting used for generating synthetic dataset
-                    num_proc = multiprocessing.cpu_count() # use all processors
-                    p = multiprocessing.Pool(num_proc)
-                    for can in tqdm(p.imap(get_ood_game, range(ood_num)), total=ood_num):
-                        if not can in self.sequences:
-                            self.sequences.append(can)
-                    p.close()
-                    t_start = time.strftime("_%Y%m%d_%H%M%S")
+                    bar = tqdm(total=ood_num)
+                    for games, _, num_generated, _ in generate_ood_games(ood_num):
+                        self.sequences.extend(games)
+                        bar.update(num_generated)
+                    bar.close()
                     if ood_num > 1000:
-                        with open(f'./data/{wanna_use}/gen10e5_{t_start}.pickle', 'wb') as handle:
-                            pickle.dump(self.sequences, handle, protocol=pickle.HIGHEST_PROTOCOL)
+                        writer = CorpusWriter(f"./data/{generated}")
+                        writer.extend(self.sequences)
+                        writer.close()
                 else:
-                    bar = tqdm(os.listdir(f"./data/{wanna_use}"))
-                    trash = []
-                    cnt = 0 
-                    for f in bar:
-                        if not f.endswith(".pickle"):
-                            continue
-                        with open(os.path.join(f"./data/{wanna_use}", f), 'rb') as handle:
-                            cnt += 1
-                            if cnt > 250:
-                                break
-                            b = pickle.load(handle)
-                            if len(b) < 9e4:  # should be 1e5 each
-                                trash.append(f)
-                                continue
-                            self.sequences.extend(b)
-                        process = psutil.Process(os.getpid())
-                        mem_gb = process.memory_info().rss / 2 ** 30
-                        bar.set_description(f"Mem Used: {mem_gb:.4} GB")
-                    print("Deduplicating...")
-                    seq = self.sequences
-                    seq.sort()
-                    self.sequences = [k for k, _ in itertools.groupby(seq)]
-                    for t in trash:
-                        os.remove(os.path.join(f"./data/{wanna_use}", f))
-                    print(f"Deduplicating finished with {len(self.sequences)} games left")
-                    self.val = self.sequences[20000000:]
-                    self.sequences = self.sequences[:20000000]
-                    print(f"Using 20 million for training, {len(self.val)} for validation")
+                    # the unique games of data/{wanna_use} (downloaded pickles, or a corpus) and data/{generated} live
+                    # in data/{wanna_use}_dedup, built with bounded memory (see data/dedup.py) on first use and again
+                    # whenever games were added to a source since; pickles under 9e4 games are leftovers and skipped
+                    src = [f"./data/{folder}" for folder in [wanna_use, generated] if os.path.isdir(f"./data/{folder}")]
+                    root = f"./data/{wanna_use}_dedup"
+                    if not is_up_to_date(src, root):
+                        print("Deduplicating...")
+                        stats = dedup_corpus(src, root, min_games=9e4)
+                        print(f"Deduplicating finished with {stats['num_unique']}/{stats['num_games']} games left")
+                    # columnar corpus (see data/corpus.py): memory-mapped, nothing is loaded up front
+                    corpus = GameCorpus(root)
+                    print(f"Opened {len(corpus)} games in {len(corpus.shards)} shards")
+                    self.sequences, self.val, self.test = corpus.split(splits, split_seed)
+                    print(f"Using {len(self.sequences)} for training, {len(self.val)} for validation, {len(self.test)} for test")
         else:
-            for fn in os.listdir(data_root):
-                if criteria(fn):
-                    with open(os.path.join(data_root, fn), "r", encoding="utf-8", errors="ignore") as f:
-                        pgn_text = f.read()
-                    games = pgn.loads(pgn_text)
-                    num_ldd = len(games)
-                    processed = []
-                    res = []
-                    for game in games:
-                        tba = []
-                        for move in game.moves:
-                            x = permit(move)
-                            if x != -1:
-                                tba.append(x)
-                            else:
-                                break
-                        if len(tba) != 0:
-                            try:
-                                rr = [int(s) for s in game.result.split("-")]
-                            except:
-                                # print(game.result)
-                                # break
-                                rr = [0, 0]
-                            res.append(rr)
-                            processed.append(tba)
-
-                    num_psd = len(processed)
-                    print(f"Loaded {num_psd}/{num_ldd} (qualified/total) sequences from {fn}")
-                    self.sequences.extend(processed)
-                    self.results.extend(res)
+            # parsed in parallel on first sight of a file, then served from a sidecar cache (see data/pgn_cache.py)
+            fns = [os.path.join(data_root, fn) for fn in sorted(os.listdir(data_root)) if criteria(fn)]
+            for fn, moves, lengths, results, num_ldd in load_pgn_files(fns):
+                print(f"Loaded {len(lengths)}/{num_ldd} (qualified/total) sequences from {os.path.basename(fn)}")
+                self.sequences.extend(unpack_games(moves, lengths))
+                self.results.extend(results.tolist())
         
     def __len__(self, ):
         return len(self.sequences)
@@ -156,47 +128,152 @@ class Othello:
             tbr = self.sequences[i]
         return tbr
     
-def get_ood_game(_):
+def get_ood_game(_, rng=random):
     tbr = []
-    ab = OthelloBoardState()
+    ab = OthelloBoardState(keep_history=False)
     possible_next_steps = ab.get_valid_moves()
     while possible_next_steps:
-        next_step = random.choice(possible_next_steps)
+        next_step = rng.choice(possible_next_steps)
         tbr.append(next_step)
-        ab.update([next_step, ])
+        ab.umpire(next_step)
         possible_next_steps = ab.get_valid_moves()
     return tbr
+
+def generate_random_games(num_games, rng):
+    # num_games random legal games played in lockstep on BatchedOthelloBoards, same distribution as get_ood_game
+    # (uniform over the legal moves at every ply); rng: np.random.Generator
+    # returns packed ([N, 60] uint8 moves padded with corpus.PAD, [N] uint8 lengths)
+    boards = BatchedOthelloBoards(num_games)
+    moves = np.full((num_games, 60), PAD, dtype=np.uint8)
+    lengths = np.zeros(num_games, dtype=np.uint8)
+    for t in range(60):
+        valid = boards.get_valid_array()
+        alive = valid.any(axis=1)
+        if not alive.any():
+            break
+        keys = np.where(valid, rng.random(valid.shape), -1.)  # the largest key is a uniform pick among the legal moves
+        move = np.where(alive, keys.argmax(axis=1), -1)
+        boards.umpire(move)
+        moves[alive, t] = move[alive]
+        lengths[alive] += 1
+    return moves, lengths
+
+def get_ood_games(task):
+    # worker for generate_ood_games: a chunk of games from its own seeded rng
+    # (forked workers would otherwise share the state of the global random module and produce the same games)
+    seed, num_games = task
+    rng = random.Random(seed)
+    t_start = time.time()
+    games = [get_ood_game(0, rng) for _ in range(num_games)]
+    return os.getpid(), games, time.time() - t_start
+
+def game_hash(game):
+    # 64-bit fingerprint of a move sequence, used to deduplicate games without keeping them around
+    return int.from_bytes(hashlib.blake2b(bytes(game), digest_size=8).digest(), "little")
+
+def generate_ood_games(num_games, num_proc=None, chunk_size=10000, seed=None, seen=None):
+    # generate num_games random legal games over a process pool, in chunks of chunk_size games per task
+    # yields (new_games, worker pid, games generated in the chunk, seconds the worker spent on it) as chunks finish;
+    # new_games excludes games whose hash is already in seen, which is updated in place
+    num_proc = multiprocessing.cpu_count() if num_proc is None else num_proc  # use all processors
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    seen = set() if seen is None else seen
+    tasks = [(seed + i, min(chunk_size, num_games - start)) for i, start in enumerate(range(0, num_games, chunk_size))]
+    with multiprocessing.Pool(num_proc) as p:
+        for pid, games, elapsed in p.imap_unordered(get_ood_games, tasks):
+            new_games = []
+            for game in games:
+                h = game_hash(game)
+                if h not in seen:
+                    seen.add(h)
+                    new_games.append(game)
+            yield new_games, pid, len(games), elapsed
     
-def get(ood_perc=0., data_root=None, wthor=False, ood_num=1000):
-    return Othello(ood_perc, data_root, wthor, ood_num)
+def get(ood_perc=0., data_root=None, wthor=False, ood_num=1000, splits=(20000000, None, 0), split_seed=None):
+    return Othello(ood_perc, data_root, wthor, ood_num, splits, split_seed)
     
 class OthelloBoardState():
     # 1 is black, -1 is white
-    def __init__(self, board_size = 8):
+    # the position lives in two 64-bit occupancy masks (self.black, self.white), see data/bitboard.py
+    # self.state is an 8x8 int8 array only built when someone asks for it, edits made to it are picked up by the engine
+    # ages are not incremented move by move: last_set holds the ply at which each square was last set or flipped and
+    # get_age() is ply - last_set, so a move only touches the squares it changes
+    # memory: about 350 bytes per instance without history (two ints, a 64-byte bytearray, no __dict__), so a few
+    # hundred thousand boards for an intervention sweep fit in ~100 MB; use copy() / fork() rather than deepcopy
+    __slots__ = ("board_size", "black", "white", "_state", "ply", "last_set", "next_hand_color", "history")
+
+    def __init__(self, board_size = 8, keep_history=True):
+        # keep_history: record the moves played (only used for printing), off saves memory for bulk replay
         self.board_size = board_size * board_size
-        board = np.zeros((8, 8))
-        board[3, 4] = 1
-        board[3, 3] = -1
-        board[4, 3] = 1
-        board[4, 4] = -1
-        self.initial_state = board
-        self.state = self.initial_state
-        self.age = np.zeros((8, 8))
+        self.black = INITIAL_BLACK
+        self.white = INITIAL_WHITE
+        self._state = None
+        self.ply = 0
+        self.last_set = bytearray(64)
         self.next_hand_color = 1
-        self.history = []
+        self.history = [] if keep_history else None
+
+    def copy(self, ):
+        # independent board in the same position, much cheaper than deepcopy
+        self._sync()
+        cloned = OthelloBoardState.__new__(OthelloBoardState)
+        cloned.board_size = self.board_size
+        cloned.black = self.black
+        cloned.white = self.white
+        cloned._state = None
+        cloned.ply = self.ply
+        cloned.last_set = bytearray(self.last_set)
+        cloned.next_hand_color = self.next_hand_color
+        cloned.history = None if self.history is None else list(self.history)
+        return cloned
+
+    def fork(self, moves):
+        # copy of this board with moves played on top, this board is left untouched
+        cloned = self.copy()
+        cloned.update(moves)
+        return cloned
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = to_array(self.black, self.white, dtype=np.int8)
+        return self._state
+
+    @state.setter
+    def state(self, board):
+        self._state = board
+
+    @property
+    def age(self):
+        # [8, 8] number of moves since each square was last set or flipped (empty squares count from the start)
+        return (self.ply - np.frombuffer(self.last_set, dtype=np.uint8)).astype(np.uint8).reshape(8, 8)
+
+    def _sync(self, ):
+        # re-read the occupancy masks from self.state in case it has been modified in place
+        if self._state is not None:
+            self.black, self.white = from_array(self._state)
+
+    def _sides(self, color):
+        # (own, opp) masks from the perspective of color
+        return (self.black, self.white) if color == 1 else (self.white, self.black)
 
     def get_occupied(self, ):
-        board = self.state
-        tbr = board.flatten() != 0
-        return tbr.tolist()
+        self._sync()
+        occupied = self.black | self.white
+        return [bool(occupied >> i & 1) for i in range(64)]
     def get_state(self, ):
-        board = self.state + 1  # white 0, blank 1, black 2
+        self._sync()
+        board = to_array(self.black, self.white, dtype=np.int8) + 1  # white 0, blank 1, black 2
         tbr = board.flatten()
         return tbr.tolist()
     def get_age(self, ):
-        return self.age.flatten().tolist()
+        return self.age.reshape(-1).tolist()
     def get_next_hand_color(self, ):
         return (self.next_hand_color + 1) // 2
+    def get_score(self, ):
+        # number of (black, white) discs on board
+        self._sync()
+        return popcount(self.black), popcount(self.white)
     
     def update(self, moves, prt=False):
         # takes a new move or new moves and update state
@@ -207,63 +284,61 @@ class OthelloBoardState():
             if prt:
                 self.__print__()
 
+    def _classify(self, move):
+        # status code of move (see try_move) and the discs it flips, both colors are checked in one walk
+        self._sync()
+        if not 0 <= move < 64 or (self.black | self.white) >> move & 1:
+            return NOT_A_MOVE, 0
+        own, opp = self._sides(self.next_hand_color)
+        own_flips, opp_flips = get_flips_both(own, opp, move)
+        if own_flips:
+            return REGULAR_MOVE, own_flips
+        elif opp_flips:  # means one hand is forfeited
+            return FORFEIT_MOVE, opp_flips
+        else:
+            return NOT_A_MOVE, 0
+
+    def try_move(self, move):
+        # umpire without assertions: plays move and returns REGULAR_MOVE, or FORFEIT_MOVE when the side to move has
+        # to pass and the opponent plays it; returns NOT_A_MOVE and leaves the board untouched if it is illegal
+        status, tbf = self._classify(move)
+        if status == NOT_A_MOVE:
+            return status
+        color = self.next_hand_color if status == REGULAR_MOVE else -self.next_hand_color
+        own, opp = self._sides(color)
+        own |= tbf | (1 << move)
+        opp &= ~tbf
+        if color == 1:
+            self.black, self.white = own, opp
+        else:
+            self.black, self.white = opp, own
+        changed = squares(tbf) + [move]
+        self.ply += 1
+        for ff in changed:
+            self.last_set[ff] = self.ply
+        if self._state is not None:
+            for ff in changed:
+                self._state[ff // 8, ff % 8] = color
+        self.next_hand_color = -color
+        if self.history is not None:
+            self.history.append(move)
+        return status
+
     def umpire(self, move):
+        if self.try_move(move) != NOT_A_MOVE:
+            return
         r, c = move // 8, move % 8
-        assert self.state[r, c] == 0, f"{r}-{c} is already occupied!"
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
-        if len(tbf) == 0:  # means one hand is forfeited
-            # print(f"One {color} move forfeited")
-            color *= -1
-            self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
-        if len(tbf) == 0:
-            valids = self.get_valid_moves()
-            if len(valids) == 0:
-                assert 0, "Both color cannot put piece, game should have ended!"
-            else:
-                assert 0, "Illegal move!"
-                
-        self.age += 1
-        for ff in tbf:
-            self.state[ff[0], ff[1]] *= -1
-            self.age[ff[0], ff[1]] = 0
-        self.state[r, c] = color
-        self.age[r, c] = 0
-        self.next_hand_color *= -1
-        self.history.append(move)
+        assert 0 <= move < 64, f"{move} is not on the board!"
+        assert not (self.black | self.white) >> move & 1, f"{r}-{c} is already occupied!"
+        if self.get_valid_mask() == 0:
+            assert 0, "Both color cannot put piece, game should have ended!"
+        else:
+            assert 0, "Illegal move!"
         
     def __print__(self, ):
         print("-"*20)
-        print([permit_reverse(_) for _ in self.history])
+        if self.history is not None:
+            print([permit_reverse(_) for _ in self.history])
         a = "abcdefgh"
         for k, row in enumerate(self.state.tolist()):
             tbp = []
@@ -289,8 +364,7 @@ class OthelloBoardState():
         assert len(heatmap) == 64
         heatmap = np.array(heatmap).reshape(8, 8)
         annot = [trs[_] for _ in self.state.flatten().tolist()]
-        cloned = deepcopy(self)
-        cloned.update([pdmove, ])
+        cloned = self.fork([pdmove, ])
 
         next_color = 1 - cloned.get_next_hand_color()
         annot[pdmove] = ("\\underline{" + (trs[next_color * 2 -1]) + "}")[-13:]
@@ -328,68 +402,23 @@ class OthelloBoardState():
         # returns 0 if this is not a move at all: occupied or both player have to forfeit
         # return 1 if regular move
         # return 2 if forfeit happens but the opponent can drop piece at this place
-        r, c = move // 8, move % 8
-        if not self.state[r, c] == 0:
-            return 0
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
-        if len(tbf) != 0:
-            return 1
-        else:  # means one hand is forfeited
-            # print(f"One {color} move forfeited")
-            color *= -1
-            # self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
-            if len(tbf) == 0:
-                return 0
-            else:
-                return 2
+        return self._classify(move)[0]
         
+    def get_valid_mask(self, ):
+        # legal moves as a 64-bit mask: the ones of the side to move, or the opponent's if that side has to forfeit
+        self._sync()
+        own, opp = self._sides(self.next_hand_color)
+        moves = get_moves(own, opp)
+        if moves:
+            return moves
+        return get_moves(opp, own)
+
+    def get_valid_array(self, ):
+        # legal moves as a [64] boolean array, same squares as get_valid_mask
+        return to_bool_array(self.get_valid_mask())
+
     def get_valid_moves(self, ):
-        regular_moves = []
-        forfeit_moves = []
-        for move in range(64):
-            x = self.tentative_move(move)
-            if x == 1:
-                regular_moves.append(move)
-            elif x == 2:
-                forfeit_moves.append(move)
-            else:
-                pass
-        if len(regular_moves):
-            return regular_moves
-        elif len(forfeit_moves):
-            return forfeit_moves
-        else:
-            return []
+        return squares(self.get_valid_mask())
  
     def get_gt(self, moves, func, prt=False):
         # takes a new move or new moves and update state
@@ -404,5 +433,114 @@ class OthelloBoardState():
                 self.__print__()
         return container
 
+class BatchedOthelloBoards():
+    # N games played in lockstep, one uint64 occupancy mask per color and game, 1 is black, -1 is white
+    # moves are given one column at a time, a negative move (e.g. the -100 padding) leaves that game untouched
+    def __init__(self, num_games):
+        self.num_games = num_games
+        self.black = np.full(num_games, INITIAL_BLACK, dtype=np.uint64)
+        self.white = np.full(num_games, INITIAL_WHITE, dtype=np.uint64)
+        self.ply = np.zeros(num_games, dtype=np.uint8)
+        self.last_set = np.zeros((num_games, 64), dtype=np.uint8)  # see OthelloBoardState.last_set
+        self.next_hand_color = np.ones(num_games, dtype=np.int8)
+
+    def _sides(self, ):
+        is_black = self.next_hand_color == 1
+        own = np.where(is_black, self.black, self.white)
+        opp = np.where(is_black, self.white, self.black)
+        return own, opp
+
+    def get_board(self, ):
+        # [N, 8, 8], 1 for black, -1 for white, 0 for blank, same as OthelloBoardState.state
+        board = unpack_batch(self.black).astype(np.int8) - unpack_batch(self.white).astype(np.int8)
+        return board.reshape(-1, 8, 8)
+    def get_state(self, ):
+        # [N, 64], white 0, blank 1, black 2
+        return self.get_board().reshape(-1, 64) + 1
+    def get_age(self, ):
+        return self.ply[:, None] - self.last_set
+    def get_next_hand_color(self, ):
+        return (self.next_hand_color + 1) // 2
+    def get_score(self, ):
+        black = unpack_batch(self.black).sum(axis=1)
+        white = unpack_batch(self.white).sum(axis=1)
+        return black, white
+
+    def get_valid_mask(self, ):
+        # [N] uint64, see OthelloBoardState.get_valid_mask
+        own, opp = self._sides()
+        moves = get_moves_batch(own, opp)
+        forfeit = moves == 0
+        if forfeit.any():
+            moves[forfeit] = get_moves_batch(opp[forfeit], own[forfeit])
+        return moves
+    def get_valid_array(self, ):
+        # [N, 64] boolean array of legal moves
+        return unpack_batch(self.get_valid_mask())
+    def get_mover(self, ):
+        # [N] color playing the legal moves of get_valid_mask: the side to move, the opponent if that side has to
+        # forfeit, 0 once neither can move (game over)
+        own, opp = self._sides()
+        has_own = get_moves_batch(own, opp) != 0
+        has_opp = get_moves_batch(opp, own) != 0
+        mover = np.where(has_own, self.next_hand_color, np.where(has_opp, -self.next_hand_color, 0))
+        return mover.astype(np.int8)
+
+    def try_umpire(self, moves):
+        # moves: [N] square indices, one per game; returns [N] status codes like OthelloBoardState.try_move
+        # games whose move is illegal for both colors are left untouched, as are padded games (both NOT_A_MOVE)
+        moves = np.asarray(moves)
+        played = (moves >= 0) & (moves < 64)
+        bit = np.where(played, np.left_shift(np.uint64(1), np.where(played, moves, 0).astype(np.uint64)), np.uint64(0))
+        played &= ((self.black | self.white) & bit) == 0
+        own, opp = self._sides()
+        color = self.next_hand_color.copy()
+        tbf = get_flips_batch(own, opp, bit)
+        forfeit = played & (tbf == 0)  # means one hand is forfeited
+        if forfeit.any():
+            tbf[forfeit] = get_flips_batch(opp[forfeit], own[forfeit], bit[forfeit])
+            color[forfeit] *= -1
+        played &= tbf != 0
+        tbf[~played] = 0
+        bit[~played] = 0
+        status = np.where(played, np.where(forfeit, FORFEIT_MOVE, REGULAR_MOVE), NOT_A_MOVE).astype(np.int8)
+
+        is_black = color == 1
+        changed = tbf | bit
+        self.black = np.where(is_black, self.black | changed, self.black & ~tbf)
+        self.white = np.where(is_black, self.white & ~tbf, self.white | changed)
+        self.ply[played] += 1
+        changed = unpack_batch(changed)
+        self.last_set[changed] = np.broadcast_to(self.ply[:, None], changed.shape)[changed]
+        self.next_hand_color = np.where(played, -color, self.next_hand_color).astype(np.int8)
+        return status
+
+    def umpire(self, moves):
+        # moves: [N] square indices, one per game, negative for padding
+        moves = np.asarray(moves)
+        illegal = (moves >= 0) & (self.try_umpire(moves) == NOT_A_MOVE)
+        assert not illegal.any(), f"Illegal moves in games {np.flatnonzero(illegal).tolist()}!"
+
+    def update(self, moves):
+        # moves: [N, T], applied column by column
+        for t in range(moves.shape[1]):
+            self.umpire(moves[:, t])
+
+    def get_gt(self, moves, func):
+        # batched OthelloBoardState.get_gt: replay [N, T] moves and stack getattr(self, func)() after each column
+        # e.g. "get_state" -> [N, T, 64], "get_next_hand_color" -> [N, T]
+        return self.get_all_gt(moves, [func])[func]
+
+    def get_all_gt(self, moves, funcs=("get_state", "get_age", "get_valid_array", "get_next_hand_color")):
+        # several ground truths out of a single replay, returns {func: [N, T, ...] array}
+        moves = np.asarray(moves)
+        container = {func: [] for func in funcs}
+        for t in range(moves.shape[1]):
+            self.umpire(moves[:, t])
+            for func in funcs:
+                container[func].append(getattr(self, func)())
+        return {func: np.stack(container[func], axis=1) for func in funcs}
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,115 @@
+import os
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+import pgn
+
+from .corpus import CorpusWriter, pack_games
+
+# Championship PGN files parsed once. Parsing is cached per file under data_root/.pgn_cache, keyed by a hash of the
+# file content, as a sidecar .npz holding the packed games ([N, 60] uint8 moves, [N] uint8 lengths), the [N, 2]
+# results and the number of games in the file. Unchanged files are loaded from their sidecar, the others are parsed
+# across a process pool; results come back in file order either way.
+
+CACHE_DIR = ".pgn_cache"
+PARSER_VERSION = 1  # bump to invalidate every sidecar when parse_pgn changes
+
+
+def content_hash(fn):
+    h = hashlib.blake2b(digest_size=8)
+    h.update(str(PARSER_VERSION).encode())
+    with open(fn, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sidecar_path(fn, digest):
+    return os.path.join(os.path.dirname(fn), CACHE_DIR, f"{os.path.basename(fn)}.{digest}.npz")
+
+
+def parse_pgn(fn):
+    # (games, results, number of games in the file) of a PGN file, games are cut at their first unreadable move
+    from .othello import permit  # data.othello imports this module
+    with open(fn, "r", encoding="utf-8", errors="ignore") as f:
+        pgn_text = f.read()
+    games = pgn.loads(pgn_text)
+    processed = []
+    res = []
+    for game in games:
+        tba = []
+        for move in game.moves:
+            x = permit(move)
+            if x != -1:
+                tba.append(x)
+            else:
+                break
+        if len(tba) != 0:
+            try:
+                rr = [int(s) for s in game.result.split("-")]
+            except:
+                rr = [0, 0]
+            res.append(rr)
+            processed.append(tba)
+    return processed, res, len(games)
+
+
+def parse_to_sidecar(task):
+    # worker: parse one file and write its sidecar, returns what load_sidecar would
+    fn, digest = task
+    games, res, num_games = parse_pgn(fn)
+    moves, lengths = pack_games(games)
+    results = np.array(res, dtype=np.int16).reshape(-1, 2)
+    path = sidecar_path(fn, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, moves=moves, lengths=lengths, results=results, num_games=num_games)
+    os.replace(path + ".tmp", path)
+    for old in os.listdir(os.path.dirname(path)):  # sidecars of earlier versions of the file
+        if old.startswith(os.path.basename(fn) + ".") and old.endswith(".npz") and len(old) == len(os.path.basename(path)) \
+                and old != os.path.basename(path):
+            os.remove(os.path.join(os.path.dirname(path), old))
+    return moves, lengths, results, num_games
+
+
+def load_sidecar(path):
+    with np.load(path) as z:
+        return z["moves"], z["lengths"], z["results"], int(z["num_games"])
+
+
+def load_pgn_files(fns, num_proc=None):
+    # yields (fn, [N, 60] moves, [N] lengths, [N, 2] results, games in the file) for every file of fns, in order
+    digests = [content_hash(fn) for fn in fns]
+    todo = [(fn, d) for fn, d in zip(fns, digests) if not os.path.exists(sidecar_path(fn, d))]
+    num_proc = min(multiprocessing.cpu_count() if num_proc is None else num_proc, len(todo))
+    pool = multiprocessing.Pool(num_proc) if num_proc > 1 else None
+    try:
+        parsed = pool.imap(parse_to_sidecar, todo) if pool is not None else map(parse_to_sidecar, todo)
+        fresh = set(fn for fn, _ in todo)
+        for fn, d in zip(fns, digests):
+            yield (fn, ) + (next(parsed) if fn in fresh else load_sidecar(sidecar_path(fn, d)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def unpack_games(moves, lengths):
+    return [m[:l].tolist() for m, l in zip(moves, lengths)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert championship PGN files to the columnar corpus format')
+    parser.add_argument('--src', default="./data/othello_championship", type=str)
+    parser.add_argument('--dst', default="./data/othello_championship_corpus", type=str)
+    parser.add_argument('--wthor', action='store_true', help='read *.pgn files instead of liveothello*')
+    parser.add_argument('--workers', default=None, type=int)
+    args, _ = parser.parse_known_args()
+    criteria = lambda fn: fn.endswith("pgn") if args.wthor else fn.startswith("liveothello")
+    fns = [os.path.join(args.src, fn) for fn in sorted(os.listdir(args.src)) if criteria(fn)]
+    writer = CorpusWriter(args.dst, sync_index=False)
+    for fn, moves, lengths, results, num_ldd in load_pgn_files(fns, args.workers):
+        print(f"Loaded {len(lengths)}/{num_ldd} (qualified/total) sequences from {fn}")
+        writer.extend_packed(moves, lengths)
+    print(f"{writer.close()} games in {args.dst}")
@@ -0,0 +1,122 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+from .othello import OthelloBoardState
+
+# Board states keyed by the move prefix leading to them. Probing, intervention and plotting code replays the same
+# game prefixes over and over; with a cache every prefix is simulated once and later served by a lookup.
+# In memory the cache is an LRU dict bytes(prefix) -> snapshot (masks, side to move, last_set). It can be saved to a directory of .npy files
+# (sorted 64-bit prefix hashes plus one array per field) that later runs open memory-mapped as a second level.
+
+STORE_FIELDS = ["hashes", "black", "white", "next_hand_color", "last_set"]
+
+
+def prefix_key(moves):
+    return bytes(moves)
+
+
+def prefix_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def snapshot(board):
+    board._sync()
+    return board.black, board.white, board.next_hand_color, bytes(board.last_set)
+
+
+def restore(snap, moves):
+    board = OthelloBoardState()
+    board.black, board.white, board.next_hand_color = int(snap[0]), int(snap[1]), int(snap[2])
+    board.ply = len(moves)
+    board.last_set = bytearray(snap[3])
+    board.history = list(moves)
+    return board
+
+
+class ReplayCache():
+    def __init__(self, maxsize=100000, path=None):
+        # maxsize: number of prefixes kept in memory
+        # path: directory of a store written by save(), opened memory-mapped if it exists
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = None
+        if path is not None and os.path.exists(os.path.join(path, "hashes.npy")):
+            self.store = {k: np.load(os.path.join(path, f"{k}.npy"), mmap_mode="r") for k in STORE_FIELDS}
+
+    def __len__(self, ):
+        return len(self.entries)
+
+    def _lookup(self, key):
+        snap = self.entries.get(key)
+        if snap is not None:
+            self.entries.move_to_end(key)
+            return snap
+        if self.store is not None and len(self.store["hashes"]):
+            h = prefix_hash(key)
+            i = np.searchsorted(self.store["hashes"], np.uint64(h))
+            if i < len(self.store["hashes"]) and self.store["hashes"][i] == h:
+                snap = (self.store["black"][i], self.store["white"][i], self.store["next_hand_color"][i],
+                        self.store["last_set"][i].tobytes())
+                self._insert(key, snap)
+                return snap
+        return None
+
+    def _insert(self, key, snap):
+        self.entries[key] = snap
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get_board(self, moves):
+        # a fresh OthelloBoardState after playing moves, free to be modified by the caller
+        moves = [int(_) for _ in moves]
+        for k in range(len(moves), -1, -1):
+            snap = self._lookup(prefix_key(moves[:k]))
+            if snap is not None or k == 0:
+                break
+        if snap is None:
+            board = OthelloBoardState()
+        else:
+            board = restore(snap, moves[:k])
+        if k == len(moves):
+            self.hits += 1
+            return board
+        self.misses += 1
+        for j in range(k, len(moves)):
+            board.umpire(moves[j])
+            self._insert(prefix_key(moves[:j + 1]), snapshot(board))
+        return board
+
+    def get_gt(self, moves, func):
+        # same as OthelloBoardState().get_gt(moves, func), served from the cache
+        moves = [int(_) for _ in moves]
+        self.get_board(moves)  # makes sure every prefix is cached
+        return [getattr(self.get_board(moves[:k]), func)() for k in range(1, len(moves) + 1)]
+
+    def save(self, path=None):
+        # write the in-memory prefixes, merged with the store this cache was opened with, to path
+        path = self.path if path is None else path
+        os.makedirs(path, exist_ok=True)
+        snaps = list(self.entries.items())
+        arrays = {
+            "hashes": np.array([prefix_hash(k) for k, _ in snaps], dtype=np.uint64),
+            "black": np.array([s[0] for _, s in snaps], dtype=np.uint64),
+            "white": np.array([s[1] for _, s in snaps], dtype=np.uint64),
+            "next_hand_color": np.array([s[2] for _, s in snaps], dtype=np.int8),
+            "last_set": np.frombuffer(b"".join([s[3] for _, s in snaps]), dtype=np.uint8).reshape(-1, 64),
+        }
+        if self.store is not None:
+            arrays = {k: np.concatenate([np.asarray(self.store[k]), arrays[k]]) for k in STORE_FIELDS}
+        _, keep = np.unique(arrays["hashes"], return_index=True)  # sorted by hash, one entry per prefix
+        for k in STORE_FIELDS:
+            # write aside and rename, the old files may still be memory-mapped
+            with open(os.path.join(path, f"{k}.tmp.npy"), "wb") as f:
+                np.save(f, arrays[k][keep])
+            os.replace(os.path.join(path, f"{k}.tmp.npy"), os.path.join(path, f"{k}.npy"))
+        self.path = path
+        self.store = {k: np.load(os.path.join(path, f"{k}.npy"), mmap_mode="r") for k in STORE_FIELDS}
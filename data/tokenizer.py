@@ -0,0 +1,70 @@
+import os
+import json
+import numpy as np
+import torch
+
+from .othello import start_hands
+
+# The vocabulary of the Othello GPTs: token 0 is padding (move -100), tokens 1 to 60 are the playable squares in
+# increasing order, i.e. every square but the four starting ones. This is what CharDataset finds by scanning a full
+# corpus, fixed here so that models can be used without loading any data.
+
+PAD_MOVE = -100
+PAD_TOKEN = 0
+
+
+class OthelloTokenizer():
+    def __init__(self, moves=None, max_len=60):
+        # moves: squares of tokens 1, 2, ..., the 60 playable squares by default
+        # max_len: longest game, the models see block_size = max_len - 1 tokens
+        self.moves = [s for s in range(64) if s not in start_hands] if moves is None else [int(m) for m in moves]
+        self.max_len = max_len
+        self.block_size = max_len - 1
+        self.vocab_size = len(self.moves) + 1
+        self.itos = {PAD_TOKEN: PAD_MOVE, **{i + 1: m for i, m in enumerate(self.moves)}}
+        self.stoi = {m: i for i, m in self.itos.items()}
+        # array versions of stoi / itos; moves outside the vocabulary (padding, -1, ...) encode to PAD_TOKEN
+        self.encode_lut = np.full(64, PAD_TOKEN, dtype=np.int64)
+        self.encode_lut[self.moves] = np.arange(1, self.vocab_size)
+        self.decode_lut = np.array([PAD_MOVE, ] + self.moves, dtype=np.int64)
+
+    def __eq__(self, other):
+        return isinstance(other, OthelloTokenizer) and self.moves == other.moves and self.max_len == other.max_len
+
+    def encode(self, moves):
+        # moves (list, np.ndarray or torch.Tensor of any shape) -> tokens of the same shape and kind, int64
+        if isinstance(moves, torch.Tensor):
+            return torch.from_numpy(self.encode(moves.cpu().numpy())).to(moves.device)
+        moves = np.asarray(moves, dtype=np.int64)
+        board = (moves >= 0) & (moves < 64)
+        tokens = np.where(board, self.encode_lut[np.where(board, moves, 0)], PAD_TOKEN)
+        return tokens
+
+    def decode(self, tokens):
+        # tokens -> moves, PAD_MOVE for padding
+        if isinstance(tokens, torch.Tensor):
+            return torch.from_numpy(self.decode(tokens.cpu().numpy())).to(tokens.device)
+        return self.decode_lut[np.asarray(tokens, dtype=np.int64)]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"moves": self.moves, "max_len": self.max_len, "pad_move": PAD_MOVE}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            config = json.load(f)
+        return cls(config["moves"], config["max_len"])
+
+    @classmethod
+    def for_checkpoint(cls, ckpt_path):
+        # the tokenizer saved next to a checkpoint, the default vocabulary if there is none (older checkpoints)
+        path = tokenizer_path(ckpt_path)
+        return cls.load(path) if os.path.exists(path) else cls()
+
+
+def tokenizer_path(ckpt_path):
+    # tokenizer file of a checkpoint: next to a checkpoint file, or inside a checkpoint folder
+    if os.path.isdir(ckpt_path):
+        return os.path.join(ckpt_path, "tokenizer.json")
+    return os.path.splitext(ckpt_path)[0] + ".tokenizer.json"
@@ -0,0 +1,83 @@
+import torch
+
+from .othello import eights
+
+# Othello move application written with tensor ops only, so board states can be computed on the same device as
+# the model (no numpy, no host round-trip). Boards are [B, 65] int8 tensors, 1 is black, -1 is white, 0 is blank;
+# the extra cell 64 is always blank and is what rays running off the board point to.
+
+
+def _build_rays():
+    # [65, 8, 7]: for every square and every direction of eights, the squares walked over, 64 once off board
+    # (row 64 is the off-board cell itself, used for padded moves)
+    rays = torch.full((65, 8, 7), 64, dtype=torch.long)
+    for move in range(64):
+        for d, (dr, dc) in enumerate(eights):
+            r, c = move // 8, move % 8
+            for k in range(7):
+                r, c = r + dr, c + dc
+                if r < 0 or r > 7 or c < 0 or c > 7:
+                    break
+                rays[move, d, k] = r * 8 + c
+    return rays
+
+
+RAYS = _build_rays()
+
+
+def initial_boards(num_games, device=None):
+    board = torch.zeros(num_games, 65, dtype=torch.int8, device=device)
+    board[:, [28, 35]] = 1
+    board[:, [27, 36]] = -1
+    return board
+
+
+def get_flips(board, moves, color):
+    # [B, 65] mask of the discs flipped when color ([B], 1 / -1) plays moves ([B], in 0--63) on board
+    num_games = board.size(0)
+    rays = RAYS.to(board.device)[moves]  # [B, 8, 7]
+    line = torch.gather(board, 1, rays.view(num_games, -1)).view(num_games, 8, 7) * color.view(-1, 1, 1)
+    run = torch.cumprod((line == -1).to(torch.int8), dim=-1).sum(dim=-1)  # [B, 8], opponent discs next to the move
+    end = torch.gather(line, 2, run.clamp(max=6).unsqueeze(-1)).squeeze(-1)  # [B, 8], the cell closing the run
+    closed = (run > 0) & (end == 1)
+    flip = (torch.arange(7, device=board.device) < run.unsqueeze(-1)) & closed.unsqueeze(-1)  # [B, 8, 7]
+    tbf = torch.zeros_like(board, dtype=torch.bool)
+    tbf.scatter_(1, rays.view(num_games, -1), flip.view(num_games, -1))  # squares show up at most once per move
+    tbf[:, 64] = False
+    return tbf
+
+
+def umpire(board, moves, color):
+    # play one move per game, same rules as OthelloBoardState.umpire including forfeits: if the side to move cannot
+    # flip anything there, the move is played by the opponent. Negative moves (padding) leave the game untouched.
+    # Nothing is checked to avoid syncing with the device, an illegal move just drops a disc without flipping.
+    # board: [B, 65] int8, moves: [B] long, color: [B] int8 of the side to move; returns the new board and color
+    played = moves >= 0
+    square = torch.where(played, moves, torch.full_like(moves, 64))
+    tbf = get_flips(board, square, color)
+    forfeit = played & ~tbf.any(dim=-1)
+    color = torch.where(forfeit, -color, color)
+    tbf = torch.where(forfeit.unsqueeze(-1), get_flips(board, square, color), tbf)
+    tbf.scatter_(1, square.unsqueeze(-1), played.unsqueeze(-1))
+    tbf[:, 64] = False
+    board = torch.where(tbf, color.unsqueeze(-1), board)
+    color = torch.where(played, -color, color)
+    return board, color
+
+
+def seq_to_state_stack(moves):
+    # [B, T] square indices -> [B, T, 8, 8] int8 boards after each move, on the device of moves
+    num_games = moves.size(0)
+    board = initial_boards(num_games, device=moves.device)
+    color = torch.ones(num_games, dtype=torch.int8, device=moves.device)
+    states = []
+    for t in range(moves.size(1)):
+        board, color = umpire(board, moves[:, t].long(), color)
+        states.append(board[:, :64])
+    return torch.stack(states, dim=1).view(num_games, -1, 8, 8)
+
+
+def state_stack_to_one_hot(state_stack, modes=3):
+    # [B, T, 8, 8] boards -> [modes, B, T, 8, 8, 3] one-hot of blank / white / black, repeated for every probe mode
+    one_hot = torch.stack([state_stack == 0, state_stack == -1, state_stack == 1], dim=-1).to(torch.int)
+    return one_hot.unsqueeze(0).expand(modes, *one_hot.shape)
@@ -0,0 +1,126 @@
+"""
+Score a GPT checkpoint on the main metric of the paper: is the top-1 prediction a legal move, at every position of
+every game of a corpus split. Games are streamed from the memory-mapped corpus in large batches; a background thread
+(mingpt.loader.BatchLoader) replays each batch on BatchedOthelloBoards for the legal-move masks while the model runs
+on the previous one. A position counts when a next move exists, i.e. positions 0 .. length - 2 of every game.
+Reports the overall top-1 legality, and error rates by position and by game length (--out saves them all as JSON).
+The split is drawn as in data.othello.Othello: --train_games first games (after a permutation with --split_seed),
+validation the rest; --split all scores a corpus that was not used for training, e.g. the championship corpus.
+Usage: python evaluate_legal_moves.py --ckpt ./ckpts/gpt_synthetic.ckpt --corpus ./data/othello_synthetic_dedup
+"""
+import json
+import time
+import argparse
+import numpy as np
+import torch
+
+from data.corpus import GameCorpus, PAD
+from data.othello import BatchedOthelloBoards
+from data.tokenizer import OthelloTokenizer
+from mingpt.model import GPT, GPTConfig
+from mingpt.loader import BatchLoader
+from mingpt.utils import legal_token_mask
+
+
+class LegalMoveDataset():
+    # get_batch(indices) -> ([B, block_size] input tokens, [B, block_size, vocab_size] legal next tokens,
+    # [B, block_size] positions that have a next move, [B] game lengths), for BatchLoader
+    def __init__(self, corpus, tokenizer):
+        self.corpus = corpus
+        self.tokenizer = tokenizer
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def get_batch(self, indices):
+        moves, lengths = self.corpus.get_batch(indices)
+        moves = np.where(moves == PAD, -1, moves.astype(np.int64))
+        block_size = self.tokenizer.block_size
+        # legal moves after each of the first block_size moves, the targets of positions 0 .. block_size - 1
+        valid = BatchedOthelloBoards(len(moves)).get_gt(moves[:, :block_size], "get_valid_array")
+        legal = legal_token_mask(valid.reshape(-1, 64), self.tokenizer).reshape(len(moves), block_size, -1)
+        counted = np.arange(block_size)[None, :] < lengths[:, None].astype(np.int64) - 1
+        x = self.tokenizer.encode(moves[:, :block_size])
+        return torch.from_numpy(x), legal, torch.from_numpy(counted), torch.from_numpy(lengths.astype(np.int64))
+
+
+@torch.no_grad()
+def evaluate(model, dataset, batch_size, device, prefetch=2, log_every=100):
+    # [block_size] positions and errors by position, [61] by game length
+    block_size = dataset.tokenizer.block_size
+    by_position = np.zeros((2, block_size), dtype=np.int64)
+    by_length = np.zeros((2, block_size + 2), dtype=np.int64)
+    loader = BatchLoader(dataset, batch_size, prefetch=prefetch)
+    t_start = time.perf_counter()
+    for it, (x, legal, counted, lengths) in enumerate(loader):
+        logits, _ = model(x.to(device))
+        top1 = logits.argmax(dim=-1).cpu()
+        error = ~legal.gather(2, top1.unsqueeze(2)).squeeze(2) & counted
+        by_position[0] += counted.sum(dim=0).numpy()
+        by_position[1] += error.sum(dim=0).numpy()
+        by_length[0] += np.bincount(lengths.numpy(), weights=counted.sum(dim=1).numpy(), minlength=block_size + 2).astype(np.int64)
+        by_length[1] += np.bincount(lengths.numpy(), weights=error.sum(dim=1).numpy(), minlength=block_size + 2).astype(np.int64)
+        if log_every and (it + 1) % log_every == 0:
+            elapsed = time.perf_counter() - t_start
+            print(f"{(it + 1) * batch_size} games, {by_position[0].sum() / elapsed:.0f} positions/s, "
+                  f"top-1 legal {1 - by_position[1].sum() / max(by_position[0].sum(), 1):.4%}")
+    return by_position, by_length, time.perf_counter() - t_start
+
+
+def error_table(counts, bin_size):
+    # error rate per bin of bin_size consecutive entries of counts ([2, n] positions, errors), empty bins skipped
+    lines = []
+    for start in range(0, counts.shape[1], bin_size):
+        total, errors = counts[:, start:start + bin_size].sum(axis=1)
+        if total:
+            lines.append(f"  {start:>2}-{min(start + bin_size, counts.shape[1]) - 1:>2}: "
+                         f"error {errors / total:8.4%} of {total}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Top-1 legal-move accuracy of a GPT checkpoint')
+    parser.add_argument('--ckpt', default="./ckpts/gpt_synthetic.ckpt", type=str)
+    parser.add_argument('--corpus', default="./data/othello_synthetic_dedup", type=str, help='the deduplicated corpus Othello trains on')
+    parser.add_argument('--split', default="val", type=str, choices=["val", "all"])
+    parser.add_argument('--train_games', default=20000000, type=int, help='size of the training split, as in Othello')
+    parser.add_argument('--split_seed', default=None, type=int)
+    parser.add_argument('--max_games', default=None, type=int)
+    parser.add_argument('--batch_size', default=1024, type=int)
+    parser.add_argument('--bin', default=5, type=int, help='positions / game lengths per line of the report')
+    parser.add_argument('--n_layer', default=8, type=int)
+    parser.add_argument('--n_head', default=8, type=int)
+    parser.add_argument('--n_embd', default=512, type=int)
+    parser.add_argument('--threads', default=None, type=int)
+    parser.add_argument('--out', default=None, type=str, help='json file for the full breakdown')
+    args, _ = parser.parse_known_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    tokenizer = OthelloTokenizer.for_checkpoint(args.ckpt)
+    mconf = GPTConfig(tokenizer.vocab_size, tokenizer.block_size, n_layer=args.n_layer, n_head=args.n_head, n_embd=args.n_embd)
+    model = GPT(mconf)
+    model.load_state_dict(torch.load(args.ckpt, map_location=device))
+    model.to(device).eval()
+
+    corpus = GameCorpus(args.corpus)
+    if args.split == "val":
+        _, corpus = corpus.split((args.train_games, None), args.split_seed)
+    if args.max_games is not None:
+        corpus = corpus[:args.max_games]
+    print(f"Scoring {args.ckpt} on {len(corpus)} games of {args.corpus} ({args.split})")
+
+    by_position, by_length, elapsed = evaluate(model, LegalMoveDataset(corpus, tokenizer), args.batch_size, device)
+    total, errors = by_position.sum(axis=1)
+    print(f"top-1 legal: {1 - errors / max(total, 1):.4%} of {total} positions ({errors} errors), "
+          f"{total / elapsed:.0f} positions/s ({elapsed:.1f} s)")
+    print("error rate by position (position t predicts move t + 1 from the first t + 1 moves):")
+    print(error_table(by_position, args.bin))
+    print("error rate by game length:")
+    print(error_table(by_length, args.bin))
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({"positions": int(total), "errors": int(errors),
+                       "by_position": {"positions": by_position[0].tolist(), "errors": by_position[1].tolist()},
+                       "by_length": {"positions": by_length[0].tolist(), "errors": by_length[1].tolist()}}, f)
@@ -0,0 +1,274 @@
+"""
+Asyncio server for the GPT player of othello_game.py. Move requests of many concurrent games are queued, packed
+into right-padded batches (at most max_batch_size, or whatever arrived max_latency after the oldest request) and
+answered with one forward pass per batch, so throughput grows with the number of clients instead of one forward
+per call. The games are replayed on BatchedOthelloBoards, answers are always legal moves (masked logits).
+Protocol: one JSON object per line over TCP, {"moves": [19, 18, ...], "temperature": 1.0, "greedy": false, "id": 7}
+is answered with {"move": 17, "id": 7} (-1 once the game is over; a temperature <= 0 is greedy) or {"error": ...},
+{"stats": true} with the latency percentiles (of the last LATENCY_WINDOW requests) and the batch size histogram.
+Usage: python game_server.py --ckpt ./ckpts/gpt_synthetic.ckpt --port 8765
+       python game_server.py --ckpt ./ckpts/gpt_synthetic.ckpt --selftest 256  (local clients playing random games)
+"""
+import json
+import time
+import asyncio
+import numbers
+import argparse
+from collections import Counter, deque
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from data.othello import BatchedOthelloBoards, NOT_A_MOVE
+from mingpt.utils import top_k_logits, mask_logits, legal_token_mask
+
+LATENCY_WINDOW = 100000  # the stats report the latencies of the last requests only
+
+
+class BatchingPredictor():
+    def __init__(self, model, tokenizer, device, max_batch_size=256, max_latency=0.005, top_k=10):
+        # max_latency: seconds the oldest queued request waits for others to join its batch
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.top_k = top_k
+        self.queue = None
+        self.worker = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # seconds from enqueue to answer, per request
+        self.num_requests = 0
+        self.batch_sizes = Counter()
+
+    def start(self, ):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, ):
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+
+    async def predict(self, moves, temperature=1.0, greedy=False):
+        # next move (square) of the game moves, -1 if the game is over; ValueError if moves is not a legal game
+        # temperature <= 0 means greedy; malformed requests are rejected here, they never reach a batch
+        moves = list(moves)
+        if len(moves) > 60 or not all(isinstance(m, numbers.Integral) and not isinstance(m, bool) and 0 <= m < 64 for m in moves):
+            raise ValueError(f"moves must be at most 60 squares in 0 .. 63, got {moves}")
+        if not isinstance(temperature, numbers.Real) or isinstance(temperature, bool) or not np.isfinite(temperature):
+            raise ValueError(f"temperature must be a number, got {temperature!r}")
+        if temperature <= 0:
+            temperature, greedy = 1.0, True
+        t_start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(([int(m) for m in moves], float(temperature), bool(greedy), t_start, future))
+        return await future
+
+    async def _run(self, ):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][3] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            # the forward runs in a thread, the loop keeps accepting requests meanwhile
+            requests = [r[:3] for r in batch]
+            try:
+                results = await loop.run_in_executor(None, self._predict_batch, requests)
+            except Exception:
+                # errors are per request: one request that breaks the batch must not fail the others
+                results = await loop.run_in_executor(None, self._predict_each, requests)
+            now = time.perf_counter()
+            self.batch_sizes[len(batch)] += 1
+            self.num_requests += len(batch)
+            for (_, _, _, t_start, future), result in zip(batch, results):
+                self.latencies.append(now - t_start)
+                if future.done():  # the client went away
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _predict_each(self, requests):
+        results = []
+        for r in requests:
+            try:
+                results.extend(self._predict_batch([r]))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @torch.no_grad()
+    def _predict_batch(self, requests):
+        # [(moves, temperature, greedy)] -> next move or ValueError per request, one forward for all of them
+        n = len(requests)
+        lengths = np.array([len(r[0]) for r in requests])
+        moves = np.full((n, max(lengths.max(), 1)), -1, dtype=np.int64)
+        for i, (m, _, _) in enumerate(requests):
+            moves[i, :len(m)] = m
+        boards = BatchedOthelloBoards(n)
+        illegal = np.zeros(n, dtype=bool)
+        for t in range(moves.shape[1]):
+            illegal |= (moves[:, t] >= 0) & (boards.try_umpire(moves[:, t]) == NOT_A_MOVE)
+        valid = boards.get_valid_array()
+        over = ~valid.any(axis=1)
+
+        # right padding with token 0: causal attention keeps the logits at position length - 1 of every row exact
+        block_size = self.tokenizer.block_size
+        tokens = np.zeros((n, block_size), dtype=np.int64)
+        for i, m in enumerate(requests):
+            kept = m[0][-block_size:]
+            tokens[i, :len(kept)] = self.tokenizer.encode(kept)
+        width = max(int(min(lengths.max(), block_size)), 1)
+        x = torch.from_numpy(tokens[:, :width]).to(self.device)
+        logits, _ = self.model(x)
+        last = torch.from_numpy(np.clip(np.minimum(lengths, block_size) - 1, 0, None)).to(self.device)
+        logits = logits[torch.arange(n, device=self.device), last]
+
+        temps = torch.tensor([r[1] for r in requests], dtype=logits.dtype, device=self.device).unsqueeze(1)
+        logits = mask_logits(logits / temps, legal_token_mask(valid, self.tokenizer).to(self.device))
+        if self.top_k is not None:
+            logits = top_k_logits(logits, self.top_k)
+        sampled = torch.multinomial(F.softmax(logits, dim=-1), num_samples=1)[:, 0]
+        greedy = torch.tensor([r[2] for r in requests], device=self.device)
+        chosen = self.tokenizer.decode(torch.where(greedy, logits.argmax(dim=-1), sampled).cpu().numpy())
+
+        results = []
+        for i in range(n):
+            if illegal[i]:
+                results.append(ValueError(f"illegal move in game {requests[i][0]}"))
+            elif over[i]:
+                results.append(-1)
+            elif lengths[i] == 0:
+                results.append(26)  # no start token, same opening as OthelloGPTAI.sample_moves
+            else:
+                results.append(int(chosen[i]))
+        return results
+
+    def stats(self, ):
+        latencies = np.array(self.latencies) * 1000
+        sizes = np.array(sorted(self.batch_sizes.elements()))
+        if len(latencies) == 0:
+            return {"requests": 0}
+        return {
+            "requests": self.num_requests,
+            "batches": int(len(sizes)),
+            "mean_batch_size": float(sizes.mean()),
+            "latency_ms": dict({f"p{q}": float(np.percentile(latencies, q)) for q in [50, 90, 99]}, max=float(latencies.max())),
+            "batch_size_histogram": {int(k): v for k, v in sorted(self.batch_sizes.items())},
+        }
+
+
+async def handle_client(predictor, reader, writer):
+    # one request per line, answered in order; a client opens one connection per concurrent game
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = {}
+            try:
+                request = json.loads(line)
+                if request.get("stats"):
+                    answer = predictor.stats()
+                else:
+                    move = await predictor.predict(request["moves"], request.get("temperature", 1.0), request.get("greedy", False))
+                    answer = {"move": move}
+            except Exception as e:
+                answer = {"error": str(e)}
+            if isinstance(request, dict) and "id" in request:
+                answer["id"] = request["id"]
+            writer.write((json.dumps(answer) + "\n").encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(predictor, host, port):
+    predictor.start()
+    server = await asyncio.start_server(lambda r, w: handle_client(predictor, r, w), host, port)
+    return server
+
+
+async def request(reader, writer, payload):
+    writer.write((json.dumps(payload) + "\n").encode())
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def play_random_game(host, port, rng, greedy):
+    # local client: the server plays white against random black moves, returns the number of moves it was asked for
+    reader, writer = await asyncio.open_connection(host, port)
+    boards = BatchedOthelloBoards(1)
+    moves, asked = [], 0
+    try:
+        while True:
+            valid = np.flatnonzero(boards.get_valid_array()[0])
+            if len(valid) == 0:
+                break
+            if boards.get_mover()[0] == 1:
+                move = int(rng.choice(valid))
+            else:
+                answer = await request(reader, writer, {"moves": moves, "greedy": greedy})
+                move = answer["move"]
+                asked += 1
+            boards.umpire([move])
+            moves.append(move)
+    finally:
+        writer.close()
+    return asked
+
+
+async def selftest(predictor, num_clients, greedy, host="127.0.0.1", port=0):
+    server = await serve(predictor, host, port)
+    port = server.sockets[0].getsockname()[1]
+    rng = np.random.default_rng(0)
+    t_start = time.perf_counter()
+    asked = await asyncio.gather(*[play_random_game(host, port, rng, greedy) for _ in range(num_clients)])
+    elapsed = time.perf_counter() - t_start
+    reader, writer = await asyncio.open_connection(host, port)
+    stats = await request(reader, writer, {"stats": True})
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    await predictor.stop()
+    print(f"{num_clients} concurrent games, {sum(asked)} moves served in {elapsed:.2f} s ({sum(asked) / elapsed:.0f} moves/s)")
+    print(json.dumps(stats, indent=1))
+
+
+async def main(args):
+    from othello_game import OthelloGPTAI
+    ai = OthelloGPTAI(args.ckpt)
+    predictor = BatchingPredictor(ai.model, ai.tokenizer, ai.device, args.max_batch_size, args.max_latency_ms / 1000, args.top_k)
+    if args.selftest:
+        await selftest(predictor, args.selftest, args.greedy)
+        return
+    server = await serve(predictor, args.host, args.port)
+    print(f"Serving on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batching game server for the GPT Othello player')
+    parser.add_argument('--ckpt', default=None, type=str)
+    parser.add_argument('--host', default="127.0.0.1", type=str)
+    parser.add_argument('--port', default=8765, type=int)
+    parser.add_argument('--max_batch_size', default=256, type=int)
+    parser.add_argument('--max_latency_ms', default=5., type=float)
+    parser.add_argument('--top_k', default=10, type=int)
+    parser.add_argument('--selftest', default=0, type=int, help='play this many local games against the server and exit')
+    parser.add_argument('--greedy', action='store_true', help='selftest clients ask for the most likely legal move')
+    args, _ = parser.parse_known_args()
+    asyncio.run(main(args))
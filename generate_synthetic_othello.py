@@ -0,0 +1,49 @@
+"""
+Generate the synthetic Othello corpus: random legal games produced across a process pool, deduplicated by a
+64-bit hash per game and streamed to disk in fixed-size columnar shards (see data/corpus.py) while generation is
+still running; new shards are appended to the corpus already in --out, which is kept apart from the downloaded
+pickles in data/othello_synthetic (training deduplicates both together, see data.othello.Othello).
+Usage: python generate_synthetic_othello.py --num_games 20000000 --shard_size 100000
+"""
+import time
+import argparse
+from collections import defaultdict
+from tqdm import tqdm
+
+from data.othello import generate_ood_games, generated
+from data.corpus import CorpusWriter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic Othello games')
+    parser.add_argument('--num_games', default=20000000, type=int)
+    parser.add_argument('--shard_size', default=100000, type=int)
+    parser.add_argument('--chunk_size', default=10000, type=int, help='games per task sent to a worker')
+    parser.add_argument('--workers', default=None, type=int, help='defaults to all processors')
+    parser.add_argument('--seed', default=None, type=int)
+    parser.add_argument('--out', default=f"./data/{generated}", type=str)
+    args, _ = parser.parse_known_args()
+
+    writer = CorpusWriter(args.out, shard_size=args.shard_size)
+    num_shards = len(writer.index["shards"])
+    num_unique = 0
+    worker_games = defaultdict(int)
+    worker_time = defaultdict(float)
+    bar = tqdm(total=args.num_games)
+    t_wall = time.time()
+    for games, pid, num_generated, elapsed in generate_ood_games(args.num_games, args.workers, args.chunk_size, args.seed):
+        worker_games[pid] += num_generated
+        worker_time[pid] += elapsed
+        writer.extend(games)
+        num_unique += len(games)
+        bar.update(num_generated)
+        bar.set_description(f"{num_unique} unique, {len(writer.index['shards']) - num_shards} shards, {len(worker_games)} workers")
+    bar.close()
+    writer.close()
+    num_shards = len(writer.index["shards"]) - num_shards
+
+    total = sum(worker_games.values())
+    print(f"{num_unique}/{total} (unique/total) games in {num_shards} shards under {args.out}")
+    print(f"{total / (time.time() - t_wall):.0f} games/s overall")
+    for pid in sorted(worker_games):
+        print(f"worker {pid}: {worker_games[pid]} games, {worker_games[pid] / worker_time[pid]:.0f} games/s")
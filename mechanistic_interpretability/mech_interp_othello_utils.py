@@ -18,218 +18,14 @@ torch.set_grad_enabled(True)
 
 # %%
 
-# A class to calculate the Othello Board State, shamelessly ripped from Kenneth Li's code base
-
-rows = list("abcdefgh")
-columns = [str(_) for _ in range(1, 9)]
-
-def permit(s):
-    s = s.lower()
-    if len(s) != 2:
-        return -1
-    if s[0] not in rows or s[1] not in columns:
-        return -1
-    return rows.index(s[0]) * 8 + columns.index(s[1])
-
-def permit_reverse(integer):
-    r, c = integer // 8, integer % 8
-    return "".join([rows[r], columns[c]])
-
-start_hands = [permit(_) for _ in ["d5", "d4", "e4", "e5"]]
-eights = [[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1]]
-
-
-class OthelloBoardState():
-    # 1 is black, -1 is white
-    def __init__(self, board_size = 8):
-        self.board_size = board_size * board_size
-        board = np.zeros((8, 8))
-        board[3, 4] = 1
-        board[3, 3] = -1
-        board[4, 3] = 1
-        board[4, 4] = -1
-        self.initial_state = board
-        self.state = self.initial_state
-        self.age = np.zeros((8, 8))
-        self.next_hand_color = 1
-        self.history = []
-
-    def get_occupied(self, ):
-        board = self.state
-        tbr = board.flatten() != 0
-        return tbr.tolist()
-    def get_state(self, ):
-        board = self.state + 1  # white 0, blank 1, black 2
-        tbr = board.flatten()
-        return tbr.tolist()
-    def get_age(self, ):
-        return self.age.flatten().tolist()
-    def get_next_hand_color(self, ):
-        return (self.next_hand_color + 1) // 2
-    
-    def update(self, moves, prt=False):
-        # takes a new move or new moves and update state
-        if prt:
-            self.__print__()
-        for _, move in enumerate(moves):
-            self.umpire(move)
-            if prt:
-                self.__print__()
-
-    def umpire(self, move):
-        r, c = move // 8, move % 8
-        assert self.state[r, c] == 0, f"{r}-{c} is already occupied!"
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
-        if len(tbf) == 0:  # means one hand is forfeited
-            # print(f"One {color} move forfeited")
-            color *= -1
-            self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
-        if len(tbf) == 0:
-            valids = self.get_valid_moves()
-            if len(valids) == 0:
-                assert 0, "Both color cannot put piece, game should have ended!"
-            else:
-                assert 0, "Illegal move!"
-                
-        self.age += 1
-        for ff in tbf:
-            self.state[ff[0], ff[1]] *= -1
-            self.age[ff[0], ff[1]] = 0
-        self.state[r, c] = color
-        self.age[r, c] = 0
-        self.next_hand_color *= -1
-        self.history.append(move)
-        
-    def __print__(self, ):
-        print("-"*20)
-        print([permit_reverse(_) for _ in self.history])
-        a = "abcdefgh"
-        for k, row in enumerate(self.state.tolist()):
-            tbp = []
-            for ele in row:
-                if ele == -1:
-                    tbp.append("O")
-                elif ele == 0:
-                    tbp.append(" ")
-                else:
-                    tbp.append("X")
-            # tbp.append("\n")
-            print(" ".join([a[k]] + tbp))
-        tbp = [str(k) for k in range(1, 9)]
-        print(" ".join([" "] + tbp))
-        print("-"*20)
-        
-    def tentative_move(self, move):
-        # tentatively put a piece, do nothing to state
-        # returns 0 if this is not a move at all: occupied or both player have to forfeit
-        # return 1 if regular move
-        # return 2 if forfeit happens but the opponent can drop piece at this place
-        r, c = move // 8, move % 8
-        if not self.state[r, c] == 0:
-            return 0
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
-        if len(tbf) != 0:
-            return 1
-        else:  # means one hand is forfeited
-            # print(f"One {color} move forfeited")
-            color *= -1
-            # self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
-            if len(tbf) == 0:
-                return 0
-            else:
-                return 2
-        
-    def get_valid_moves(self, ):
-        regular_moves = []
-        forfeit_moves = []
-        for move in range(64):
-            x = self.tentative_move(move)
-            if x == 1:
-                regular_moves.append(move)
-            elif x == 2:
-                forfeit_moves.append(move)
-            else:
-                pass
-        if len(regular_moves):
-            return regular_moves
-        elif len(forfeit_moves):
-            return forfeit_moves
-        else:
-            return []
- 
-    def get_gt(self, moves, func, prt=False):
-        # takes a new move or new moves and update state
-        container = []
-        if prt:
-            self.__print__()
-        for _, move in enumerate(moves):
-            self.umpire(move)
-            container.append(getattr(self, func)())  
-            # to predict first y, we need already know the first x
-            if prt:
-                self.__print__()
-        return container
+# The Othello Board State comes from Kenneth Li's code base (data/othello.py), so run from the repo root and import
+# this file as mechanistic_interpretability.mech_interp_othello_utils.
+# Replays go through a shared ReplayCache: plotting or probing the same prefixes again is a lookup, not a simulation.
+from data.othello import OthelloBoardState, permit, permit_reverse, rows, columns, start_hands, eights
+from data.replay_cache import ReplayCache
+from data.tokenizer import OthelloTokenizer
 
+replay_cache = ReplayCache()
 
 # # %%
 # try:
@@ -279,197 +75,12 @@ class OthelloBoardState():
 # imshow(board_seqs_int[:5], title="Board Seqs Int Test")
 # imshow(board_seqs_string[:5], title="Board Seqs String Test")
 # %%
-itos = {
-    0: -100,
-    1: 0,
-    2: 1,
-    3: 2,
-    4: 3,
-    5: 4,
-    6: 5,
-    7: 6,
-    8: 7,
-    9: 8,
-    10: 9,
-    11: 10,
-    12: 11,
-    13: 12,
-    14: 13,
-    15: 14,
-    16: 15,
-    17: 16,
-    18: 17,
-    19: 18,
-    20: 19,
-    21: 20,
-    22: 21,
-    23: 22,
-    24: 23,
-    25: 24,
-    26: 25,
-    27: 26,
-    28: 29,
-    29: 30,
-    30: 31,
-    31: 32,
-    32: 33,
-    33: 34,
-    34: 37,
-    35: 38,
-    36: 39,
-    37: 40,
-    38: 41,
-    39: 42,
-    40: 43,
-    41: 44,
-    42: 45,
-    43: 46,
-    44: 47,
-    45: 48,
-    46: 49,
-    47: 50,
-    48: 51,
-    49: 52,
-    50: 53,
-    51: 54,
-    52: 55,
-    53: 56,
-    54: 57,
-    55: 58,
-    56: 59,
-    57: 60,
-    58: 61,
-    59: 62,
-    60: 63,
-}
-
-stoi = {
-    -100: 0,
-    -1: 0,
-    0: 1,
-    1: 2,
-    2: 3,
-    3: 4,
-    4: 5,
-    5: 6,
-    6: 7,
-    7: 8,
-    8: 9,
-    9: 10,
-    10: 11,
-    11: 12,
-    12: 13,
-    13: 14,
-    14: 15,
-    15: 16,
-    16: 17,
-    17: 18,
-    18: 19,
-    19: 20,
-    20: 21,
-    21: 22,
-    22: 23,
-    23: 24,
-    24: 25,
-    25: 26,
-    26: 27,
-    29: 28,
-    30: 29,
-    31: 30,
-    32: 31,
-    33: 32,
-    34: 33,
-    37: 34,
-    38: 35,
-    39: 36,
-    40: 37,
-    41: 38,
-    42: 39,
-    43: 40,
-    44: 41,
-    45: 42,
-    46: 43,
-    47: 44,
-    48: 45,
-    49: 46,
-    50: 47,
-    51: 48,
-    52: 49,
-    53: 50,
-    54: 51,
-    55: 52,
-    56: 53,
-    57: 54,
-    58: 55,
-    59: 56,
-    60: 57,
-    61: 58,
-    62: 59,
-    63: 60,
-}
+# token <-> board square, shared with the dataset and the game; -1 (pass) encodes as padding
+tokenizer = OthelloTokenizer()
+itos = tokenizer.itos
+stoi = {**tokenizer.stoi, -1: 0}
 # %%
-stoi_indices = [
-    0,
-    1,
-    2,
-    3,
-    4,
-    5,
-    6,
-    7,
-    8,
-    9,
-    10,
-    11,
-    12,
-    13,
-    14,
-    15,
-    16,
-    17,
-    18,
-    19,
-    20,
-    21,
-    22,
-    23,
-    24,
-    25,
-    26,
-    29,
-    30,
-    31,
-    32,
-    33,
-    34,
-    37,
-    38,
-    39,
-    40,
-    41,
-    42,
-    43,
-    44,
-    45,
-    46,
-    47,
-    48,
-    49,
-    50,
-    51,
-    52,
-    53,
-    54,
-    55,
-    56,
-    57,
-    58,
-    59,
-    60,
-    61,
-    62,
-    63,
-]
+stoi_indices = tokenizer.moves
 alpha = "ABCDEFGH"
 
 
@@ -555,14 +166,13 @@ int_labels = (
 def get_valid_moves(sequence):
     if isinstance(sequence, torch.Tensor):
         sequence = sequence.tolist()
-    board = OthelloBoardState()
-    return board.get_gt(sequence, "get_valid_moves")
+    return replay_cache.get_gt(sequence, "get_valid_moves")
 
 
 # get_valid_moves(board_seqs_string[0])
 # %%
 def make_plot_state(board):
-    state = np.copy(board.state).flatten()
+    state = board.state.astype(float).flatten()
     valid_moves = board.get_valid_moves()
     next_move = board.get_next_hand_color()
     # print(next_move, valid_moves)
@@ -633,12 +243,7 @@ def plot_board(moves, return_fig=False):
         moves = moves.tolist()
     if isinstance(moves[0], str):
         moves = to_string(moves)
-    board = OthelloBoardState()
-    states = []
-    states.append(make_plot_state(board))
-    for move in moves:
-        board.umpire(move)
-        states.append(make_plot_state(board))
+    states = [make_plot_state(replay_cache.get_board(moves[:i])) for i in range(len(moves) + 1)]
     states = np.stack(states, axis=0)
     fig = imshow(
         states.reshape(-1, 8, 8),
@@ -702,12 +307,7 @@ def plot_board_log_probs(moves, logits, return_fig=False, use_counters=False):
         moves = to_string(moves)
     # print(moves)
     assert len(moves) == len(logits)
-    board = OthelloBoardState()
-    states = []
-    # states.append(make_plot_state(board))
-    for move in moves:
-        board.umpire(move)
-        states.append(make_plot_state(board))
+    states = [make_plot_state(replay_cache.get_board(moves[:i])) for i in range(1, len(moves) + 1)]
     states = np.stack(states, axis=0)
 
     log_probs = logits.log_softmax(dim=-1)
@@ -795,9 +395,7 @@ def plot_single_board(moves, model=None, return_fig=False, title=None):
         moves = moves.tolist()
     if isinstance(moves[0], str):
         moves = to_string(moves)
-    board = OthelloBoardState()
-    if len(moves) > 1:
-        board.update(moves[:-1])
+    board = replay_cache.get_board(moves[:-1])
 
     prev_state = np.copy(board.state)
     prev_player = board.next_hand_color
@@ -813,7 +411,7 @@ def plot_single_board(moves, model=None, return_fig=False, title=None):
     prev_valid = moves_to_state(prev_valid_moves)
     next_valid = moves_to_state(next_valid_moves)
 
-    state = np.copy(next_state)
+    state = next_state.astype(float)
     state[flipped] *= 0.9
     state[prev_valid] = 0.1 * prev_player
     state[next_valid] = 0.5 * next_player
@@ -1,6 +1,8 @@
 import transformer_lens.utils as utils
 from transformer_lens import HookedTransformer, HookedTransformerConfig
-from mech_interp_othello_utils import OthelloBoardState
+# run from the repo root (python -m mechanistic_interpretability.tl_probing_v1), data.* and this folder are imported from there
+from mechanistic_interpretability.mech_interp_othello_utils import OthelloBoardState
+from data.torch_othello import seq_to_state_stack, state_stack_to_one_hot
 import einops
 import torch
 from tqdm import tqdm
@@ -31,21 +33,7 @@ model.load_state_dict(sd)
 board_seqs_int = torch.tensor(np.load("board_seqs_int_small.npy")).long()
 board_seqs_string = torch.tensor(np.load("board_seqs_string_small.npy"))
 # %%
-def seq_to_state_stack(str_moves):
-    if isinstance(str_moves, torch.Tensor):
-        str_moves = str_moves.tolist()
-    board = OthelloBoardState()
-    states = []
-    for move in str_moves:
-        board.umpire(move)
-        states.append(np.copy(board.state))
-    states = np.stack(states, axis=0)
-    return states
-
-
-state_stack = torch.tensor(
-    np.stack([seq_to_state_stack(seq) for seq in board_seqs_string[:50, :-1]])
-)
+state_stack = seq_to_state_stack(board_seqs_string[:50, :-1])
 print(state_stack.shape)
 # %%
 
@@ -70,22 +58,7 @@ modes = 3
 alternating = torch.tensor([1 if i%2 == 0 else -1 for i in range(length)], device="cuda")
 
 
-def state_stack_to_one_hot(state_stack):
-    one_hot = torch.zeros(
-        modes, # blank vs color (mode)
-        state_stack.shape[0], # num games
-        state_stack.shape[1], # num moves
-        rows, # rows
-        cols, # cols
-        options, # the two options
-        device=state_stack.device,
-        dtype=torch.int,
-    )
-    one_hot[:, ..., 0] = state_stack == 0
-    one_hot[:, ..., 1] = state_stack == -1
-    one_hot[:, ..., 2] = state_stack == 1
-    return one_hot
-state_stack_one_hot = state_stack_to_one_hot(state_stack)
+state_stack_one_hot = state_stack_to_one_hot(state_stack, modes)
 print(state_stack_one_hot.shape)
 print((state_stack_one_hot[:, 0, 17, 4:9, 2:5]))
 print((state_stack[0, 17, 4:9, 2:5]))
@@ -103,12 +76,11 @@ for epoch in range(num_epochs):
         indices = full_train_indices[i:i+batch_size]
         games_int = board_seqs_int[indices]
         games_str = board_seqs_string[indices]
-        state_stack = torch.stack(
-            [torch.tensor(seq_to_state_stack(games_str[i])) for i in range(batch_size)]
-        )
+        # labels are computed on the GPU next to the model, no host round-trip
+        state_stack = seq_to_state_stack(games_str.cuda())
         state_stack = state_stack[:, pos_start:pos_end, :, :]
 
-        state_stack_one_hot = state_stack_to_one_hot(state_stack).cuda()
+        state_stack_one_hot = state_stack_to_one_hot(state_stack, modes)
         with torch.inference_mode():
             _, cache = model.run_with_cache(games_int.cuda()[:, :-1], return_type=None)
             resid_post = cache["resid_post", layer][:, pos_start:pos_end]
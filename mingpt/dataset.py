@@ -1,34 +1,115 @@
+import time
+import queue
+import logging
 import itertools
+import multiprocessing
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from data.corpus import GameCorpus, pack_games, PAD
+from data.othello import generate_random_games
+from data.tokenizer import OthelloTokenizer
+
+logger = logging.getLogger(__name__)
+
+SCAN_CHUNK = 1000000  # games per vectorized pass over a corpus
+
+
+def iter_packed(data, chunk_size=SCAN_CHUNK):
+    # packed ([n, 60] uint8 moves, [n] lengths) chunks of data, a GameCorpus or a list of move lists
+    for start in range(0, len(data), chunk_size):
+        if isinstance(data, GameCorpus):
+            yield data.get_batch(np.arange(start, min(start + chunk_size, len(data))))
+        else:
+            yield pack_games(data[start:start + chunk_size])
+
 
 class CharDataset(Dataset):
-    def __init__(self, data):
+    def __init__(self, data, pre_encode=True, tokenizer=None):
+        # pre_encode: encode every game once into a [N, max_len] uint8 array of token ids through a lookup table
+        # (for a memory-mapped corpus the corpus itself is that array and the table is applied per batch), so that
+        # items are slices and __getitems__ serves a whole batch; not possible while data draws random games
+        # tokenizer: a fixed OthelloTokenizer, e.g. OthelloTokenizer(), instead of the vocabulary found in data
         if hasattr(data, "ood_perc"):
             ood_perc = data.ood_perc
             data.ood_perc = 0  # shut down the randomness
-        chars = sorted(list(set(list(itertools.chain.from_iterable(data)))) + [-100, ])
+        games = getattr(data, "sequences", data)
+        if tokenizer is not None:
+            chars = [-100, ] + tokenizer.moves
+            max_len = tokenizer.max_len
+        elif pre_encode and (isinstance(games, GameCorpus) or isinstance(games, list)):
+            # one vectorized pass instead of two scans over python lists
+            seen = np.zeros(256, dtype=bool)
+            max_len = 0
+            for moves, lengths in iter_packed(games):
+                seen[moves.ravel()] = True
+                max_len = max(max_len, int(lengths.max(initial=0)))
+            seen[PAD] = False
+            chars = [-100, ] + np.flatnonzero(seen).tolist()
+        else:
+            chars = sorted(list(set(list(itertools.chain.from_iterable(data)))) + [-100, ])
+            max_len = max([len(data[_]) for _ in range(len(data))])  # should be 60 in Othello
         data_size, vocab_size = len(data), len(chars)  # vocab size 61, with -100 sorted to the front
-        max_len = max([len(data[_]) for _ in range(len(data))])  # should be 60 in Othello
         print('Dataset created has %d sequences, %d unique words.' % (data_size, vocab_size))
         
-        self.stoi = {ch: i for i, ch in enumerate(chars)}
-        self.itos = {i: ch for i, ch in enumerate(chars)}
+        self.tokenizer = OthelloTokenizer(chars[1:], max_len) if tokenizer is None else tokenizer
+        self.stoi = self.tokenizer.stoi
+        self.itos = self.tokenizer.itos
         self.max_len = max_len
         self.block_size = max_len - 1  # for autoregressive training
         self.vocab_size = vocab_size
         if hasattr(data, "ood_perc"):
             data.ood_perc = ood_perc  # turn on the randomness
         self.data = data
+
+        self.lut = None  # move (PAD for padding) -> token id
+        self.encoded = None  # [N, max_len] token ids, or None when read from a memory-mapped corpus
+        self.corpus = None
+        if pre_encode and getattr(data, "ood_perc", 0) == 0 and (isinstance(games, GameCorpus) or isinstance(games, list)):
+            self.lut = np.zeros(256, dtype=np.uint8)  # corpus moves are uint8 with PAD for padding
+            self.lut[:64] = self.tokenizer.encode_lut
+            self.lut[PAD] = self.stoi[-100]
+            if isinstance(games, GameCorpus):
+                self.corpus = games
+            else:
+                self.encoded = np.concatenate([self.lut[moves[:, :max_len]] for moves, _ in iter_packed(games)])
     
     def __len__(self):
         return len(self.data)
 
+    @property
+    def supports_batches(self):
+        # get_tokens / get_batch need the pre-encoded games, not there with pre_encode=False or random games (ood_perc)
+        return self.lut is not None
+
+    def get_tokens(self, indices):
+        # [B, max_len] long tensor of the token ids of games indices, from the pre-encoded games
+        if self.corpus is not None:
+            moves, _ = self.corpus.get_batch(indices)
+            return torch.from_numpy(self.lut[moves[:, :self.max_len]]).long()
+        return torch.from_numpy(self.encoded[np.asarray(indices)]).long()
+
+    def get_batch(self, indices):
+        # (x, y), both [B, block_size], for games indices
+        tokens = self.get_tokens(indices)
+        return tokens[:, :-1].contiguous(), tokens[:, 1:].contiguous()
+
+    def __getitems__(self, indices):
+        # a batch in one call, as the list of (x, y) pairs the DataLoader collates
+        if self.lut is None:
+            return [self[idx] for idx in indices]
+        x, y = self.get_batch(indices)
+        return list(zip(x.unbind(0), y.unbind(0)))
+
     def __getitem__(self, idx):
+        if self.lut is not None:
+            tokens = self.get_tokens([idx])[0]
+            return tokens[:-1], tokens[1:]
         # grab a chunk of (block_size + 1) characters from the data
         chunk = self.data[idx]
         if len(chunk) != self.max_len:
-            chunk += [-100, ] * (self.max_len - len(chunk))  # -100 can be ignored in CE
+            chunk = chunk + [-100, ] * (self.max_len - len(chunk))  # -100 can be ignored in CE
         # encode every character to an integer
         dix = [self.stoi[s] for s in chunk]
         """
@@ -66,4 +147,88 @@ class CharDataset(Dataset):
         """
         x = torch.tensor(dix[:-1], dtype=torch.long)
         y = torch.tensor(dix[1:], dtype=torch.long)
-        return x, y
\ No newline at end of file
+        return x, y
+
+
+def produce_games(seed_seq, games_per_chunk, out, stop):
+    # producer process of SyntheticGameDataset: packed chunks of fresh games until stop is set
+    rng = np.random.default_rng(seed_seq)
+    while not stop.is_set():
+        chunk = generate_random_games(games_per_chunk, rng)
+        while not stop.is_set():
+            try:
+                out.put(chunk, timeout=0.1)  # blocks while the queue is full, so producers never run ahead
+                break
+            except queue.Full:
+                pass
+
+
+class SyntheticGameDataset(IterableDataset):
+    # an endless stream of fresh random legal games, encoded like CharDataset: yields (x, y), or (X, Y) batches of
+    # batch_size if given (use DataLoader(..., batch_size=None) then). Games come from num_proc producer processes
+    # (generate_random_games, batched bitboards) through a queue of at most queue_size chunks; with num_proc=0 they
+    # are generated in the iterating process, e.g. in DataLoader workers, which cannot start processes of their own.
+    # Every producer of every DataLoader worker gets its own seed, derived from seed (fresh entropy if None).
+    # The generation rate, in games per second of wall time, is kept in self.rate and logged every log_every games.
+    def __init__(self, tokenizer=None, seed=None, num_proc=1, queue_size=16, games_per_chunk=1024,
+                 batch_size=None, log_every=100000):
+        # tokenizer: OthelloTokenizer(), the vocabulary of CharDataset over a full synthetic corpus, by default
+        self.tokenizer = OthelloTokenizer() if tokenizer is None else tokenizer
+        self.stoi = self.tokenizer.stoi
+        self.itos = self.tokenizer.itos
+        self.max_len = self.tokenizer.max_len
+        self.block_size = self.tokenizer.block_size
+        self.vocab_size = self.tokenizer.vocab_size
+        self.lut = np.zeros(256, dtype=np.uint8)
+        self.lut[:64] = self.tokenizer.encode_lut
+        self.lut[PAD] = self.stoi[-100]
+        self.seed = seed
+        self.num_proc = num_proc
+        self.queue_size = queue_size
+        self.games_per_chunk = games_per_chunk
+        self.batch_size = batch_size
+        self.log_every = log_every
+        self.num_games = 0
+        self.rate = 0.
+
+    def _chunks(self, seed_seq):
+        if self.num_proc == 0:
+            rng = np.random.default_rng(seed_seq)
+            while True:
+                yield generate_random_games(self.games_per_chunk, rng)
+        out = multiprocessing.Queue(maxsize=self.queue_size)
+        stop = multiprocessing.Event()
+        producers = [multiprocessing.Process(target=produce_games, args=(s, self.games_per_chunk, out, stop), daemon=True)
+                     for s in seed_seq.spawn(self.num_proc)]
+        for p in producers:
+            p.start()
+        try:
+            while True:
+                yield out.get()
+        finally:
+            stop.set()
+            for p in producers:
+                p.join(timeout=1)
+                if p.is_alive():
+                    p.terminate()
+
+    def __iter__(self):
+        info = get_worker_info()
+        seed_seq = np.random.SeedSequence(self.seed).spawn(info.id + 1)[-1] if info is not None else \
+            np.random.SeedSequence(self.seed)
+        t_start = time.time()
+        logged = 0
+        for moves, lengths in self._chunks(seed_seq):
+            tokens = torch.from_numpy(self.lut[moves[:, :self.max_len]]).long()
+            self.num_games += len(tokens)
+            self.rate = self.num_games / (time.time() - t_start)
+            if self.num_games - logged >= self.log_every:
+                logged = self.num_games
+                logger.info("synthetic games: %d generated, %.0f games/s", self.num_games, self.rate)
+            if self.batch_size is None:
+                for row in tokens:
+                    yield row[:-1], row[1:]
+            else:
+                for i in range(0, len(tokens) - self.batch_size + 1, self.batch_size):
+                    batch = tokens[i:i + self.batch_size]
+                    yield batch[:, :-1].contiguous(), batch[:, 1:].contiguous()
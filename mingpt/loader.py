@@ -0,0 +1,93 @@
+"""
+Batched data loading for datasets that can fetch a whole batch at once through get_batch(indices) (CharDataset,
+ProbingDataset): one fancy-indexing call per step instead of batch_size __getitem__ calls and a collate.
+"""
+
+import threading
+import queue
+
+import numpy as np
+import torch
+from torch.utils.data import Subset
+
+
+def has_batches(dataset):
+    # whether BatchLoader can serve dataset (possibly a Subset of one, as made by random_split); a dataset with
+    # get_batch may still only support it in some configurations, it then says so through supports_batches
+    while isinstance(dataset, Subset):
+        dataset = dataset.dataset
+    return hasattr(dataset, "get_batch") and getattr(dataset, "supports_batches", True)
+
+
+class BatchLoader:
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False, pin_memory=False, prefetch=2, seed=None):
+        # dataset: has get_batch(indices) -> tuple of tensors with a leading batch dimension, or a Subset of one
+        # shuffle: draw a new permutation of the indices every epoch, from seed if given
+        # pin_memory: batches are copied to page-locked memory by the background thread, so that moving them to the
+        #     GPU with .to(device, non_blocking=True) overlaps with compute
+        # prefetch: how many batches the background thread prepares ahead, 0 to fetch in the calling thread
+        self.indices = np.arange(len(dataset))
+        while isinstance(dataset, Subset):
+            self.indices = np.asarray(dataset.indices)[self.indices]
+            dataset = dataset.dataset
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.indices) // self.batch_size
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+    def _fetch(self, indices):
+        batch = self.dataset.get_batch(indices)
+        if self.pin_memory:
+            batch = tuple(t.pin_memory() for t in batch)
+        return batch
+
+    def _batches(self):
+        indices = self.indices[self.rng.permutation(len(self.indices))] if self.shuffle else self.indices
+        for i in range(len(self)):
+            yield indices[i * self.batch_size:(i + 1) * self.batch_size]
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            for indices in self._batches():
+                yield self._fetch(indices)
+            return
+        # a producer thread keeps up to prefetch batches ready (numpy indexing and pinning release the GIL)
+        ready = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def produce(batches):
+            try:
+                for indices in batches:
+                    if stop.is_set():
+                        return
+                    ready.put(self._fetch(indices))
+                ready.put(done)
+            except Exception as e:
+                ready.put(e)
+
+        worker = threading.Thread(target=produce, args=(self._batches(), ), daemon=True)
+        worker.start()
+        try:
+            while True:
+                batch = ready.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            while worker.is_alive():  # unblock a producer waiting on a full queue
+                try:
+                    ready.get_nowait()
+                except queue.Empty:
+                    worker.join(timeout=0.01)
@@ -21,6 +21,8 @@ class GPTConfig:
     embd_pdrop = 0.1
     resid_pdrop = 0.1
     attn_pdrop = 0.1
+    fast_attention = True  # fused F.scaled_dot_product_attention whenever the attention weights are not needed
+    fused_qkv = True  # one (C, 3C) projection for query, key and value instead of three (C, C) ones
 
     def __init__(self, vocab_size, block_size, **kwargs):
         self.vocab_size = vocab_size
@@ -38,10 +40,16 @@ class CausalSelfAttention(nn.Module):
     def __init__(self, config):
         super().__init__()
         assert config.n_embd % config.n_head == 0
-        # key, query, value projections for all heads
-        self.key = nn.Linear(config.n_embd, config.n_embd)
-        self.query = nn.Linear(config.n_embd, config.n_embd)
-        self.value = nn.Linear(config.n_embd, config.n_embd)
+        # key, query, value projections for all heads, fused into one matmul by default
+        self.fused_qkv = config.fused_qkv
+        if self.fused_qkv:
+            self.qkv = nn.Linear(config.n_embd, 3 * config.n_embd)  # rows: query, key, value
+            # state_dict() gives the unfused layout, checkpoints stay the same whatever the model runs with
+            self._register_state_dict_hook(unfuse_qkv_hook)
+        else:
+            self.key = nn.Linear(config.n_embd, config.n_embd)
+            self.query = nn.Linear(config.n_embd, config.n_embd)
+            self.value = nn.Linear(config.n_embd, config.n_embd)
         # regularization
         self.attn_drop = nn.Dropout(config.attn_pdrop)
         self.resid_drop = nn.Dropout(config.resid_pdrop)
@@ -51,18 +59,44 @@ class CausalSelfAttention(nn.Module):
         self.register_buffer("mask", torch.tril(torch.ones(config.block_size, config.block_size))
                                      .view(1, 1, config.block_size, config.block_size))
         self.n_head = config.n_head
+        self.fast_attention = config.fast_attention
 
-    def forward(self, x, layer_past=None, only_last=-1):
+    def forward(self, x, layer_past=None, only_last=-1, need_weights=True, use_cache=False):
+        # need_weights: whether att is returned, otherwise it is None and the fused kernel may be used
+        # layer_past: (k, v) of the previous positions, each (B, nh, T_past, hs), x then only holds the new positions
+        # use_cache: also return (k, v) of all positions, to be passed as layer_past at the next step
         B, T, C = x.size()
 
         # calculate query, key, values for all heads in batch and move head forward to be the batch dim
-        k = self.key(x).view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
-        q = self.query(x).view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
-        v = self.value(x).view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
-
-        # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, T) -> (B, nh, T, T)
+        if self.fused_qkv:
+            q, k, v = self.qkv(x).split(C, dim=2)
+        else:
+            q, k, v = self.query(x), self.key(x), self.value(x)
+        k = k.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
+        P = 0  # number of cached positions
+        if layer_past is not None:
+            P = layer_past[0].size(2)
+            k = torch.cat((layer_past[0], k), dim=2)  # (B, nh, P + T, hs)
+            v = torch.cat((layer_past[1], v), dim=2)
+        present = (k, v) if use_cache else None
+
+        if self.fast_attention and not need_weights and only_last == -1:
+            # same causal attention without materializing the (B, nh, T, T) matrix
+            dropout_p = self.attn_drop.p if self.training else 0.
+            if P == 0:
+                y = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, is_causal=True)
+            else:  # new positions see every cached one, T == 1 needs no mask at all
+                mask = None if T == 1 else self.mask[:, :, P:P + T, :P + T] != 0
+                y = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout_p)
+            y = y.transpose(1, 2).contiguous().view(B, T, C)
+            y = self.resid_drop(self.proj(y))
+            return (y, None, present) if use_cache else (y, None)
+
+        # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, P + T) -> (B, nh, T, P + T)
         att = (q @ k.transpose(-2, -1)) * (1.0 / math.sqrt(k.size(-1)))
-        att = att.masked_fill(self.mask[:,:,:T,:T] == 0, float('-inf'))
+        att = att.masked_fill(self.mask[:,:,P:P + T,:P + T] == 0, float('-inf'))
         if only_last != -1:
             att[:, :, -only_last:, :-only_last] = float('-inf')
         att = F.softmax(att, dim=-1)
@@ -71,7 +105,34 @@ class CausalSelfAttention(nn.Module):
 
         # output projection
         y = self.resid_drop(self.proj(y))
-        return y, att
+        return (y, att, present) if use_cache else (y, att)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints of either layout load into either layout, e.g. gpt_synthetic.ckpt into a fused model
+        if self.fused_qkv:
+            fuse_qkv(state_dict, prefix)
+        else:
+            unfuse_qkv(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+def fuse_qkv(state_dict, prefix=""):
+    # in place: {prefix}query/key/value.weight/bias -> {prefix}qkv.weight/bias
+    for p in ["weight", "bias"]:
+        names = [f"{prefix}{m}.{p}" for m in ["query", "key", "value"]]
+        if all(n in state_dict for n in names):
+            state_dict[f"{prefix}qkv.{p}"] = torch.cat([state_dict.pop(n) for n in names], dim=0)
+    return state_dict
+
+def unfuse_qkv(state_dict, prefix=""):
+    # in place: {prefix}qkv.weight/bias -> {prefix}query/key/value.weight/bias, the layout of the original checkpoints
+    for p in ["weight", "bias"]:
+        if f"{prefix}qkv.{p}" in state_dict:
+            q, k, v = state_dict.pop(f"{prefix}qkv.{p}").chunk(3, dim=0)
+            state_dict.update({f"{prefix}query.{p}": q, f"{prefix}key.{p}": k, f"{prefix}value.{p}": v})
+    return state_dict
+
+def unfuse_qkv_hook(module, state_dict, prefix, local_metadata):
+    unfuse_qkv(state_dict, prefix)
 
 class Block(nn.Module):
     """ an unassuming Transformer block """
@@ -88,10 +149,16 @@ class Block(nn.Module):
             nn.Dropout(config.resid_pdrop),
         )
 
-    def forward(self, x, return_att=False, only_last=-1):
-        updt, att = self.attn(self.ln1(x), only_last=only_last)
+    def forward(self, x, return_att=False, only_last=-1, layer_past=None, use_cache=False):
+        # with use_cache the (k, v) of this layer are returned last, see CausalSelfAttention
+        if use_cache:
+            updt, att, present = self.attn(self.ln1(x), layer_past, only_last=only_last, need_weights=return_att, use_cache=True)
+        else:
+            updt, att = self.attn(self.ln1(x), layer_past, only_last=only_last, need_weights=return_att)
         x = x + updt
         x = x + self.mlp(self.ln2(x))
+        if use_cache:
+            return (x, att, present) if return_att else (x, present)
         if return_att:
             return x, att
         else:
@@ -177,21 +244,33 @@ class GPT(nn.Module):
         optimizer = torch.optim.AdamW(optim_groups, lr=train_config.learning_rate, betas=train_config.betas)
         return optimizer
 
-    def forward(self, idx, targets=None):
+    def forward(self, idx, targets=None, past_key_values=None, use_cache=False):
+        # past_key_values: what an earlier call with use_cache=True returned for the previous positions, idx then
+        # only holds the new tokens; with use_cache=True the (k, v) of every layer are returned as a third value
         b, t = idx.size()  # both of shape [B, T]
-        assert t <= self.block_size, "Cannot forward, model block size is exhausted."
+        past = 0 if past_key_values is None else past_key_values[0][0].size(2)
+        assert past + t <= self.block_size, "Cannot forward, model block size is exhausted."
 
         # forward the GPT model
         token_embeddings = self.tok_emb(idx) # each index maps to a (learnable) vector
-        position_embeddings = self.pos_emb[:, :t, :] # each position maps to a (learnable) vector
+        position_embeddings = self.pos_emb[:, past:past + t, :] # each position maps to a (learnable) vector
         x = self.drop(token_embeddings + position_embeddings)
-        x = self.blocks(x)
+        presents = None
+        if past_key_values is None and not use_cache:
+            x = self.blocks(x)
+        else:
+            presents = []
+            for i, block in enumerate(self.blocks):
+                x, present = block(x, layer_past=None if past_key_values is None else past_key_values[i], use_cache=True)
+                presents.append(present)
         x = self.ln_f(x)  # [B, T, f]
         logits = self.head(x)  # [B, T, # Words]
         # if we are given some desired targets also calculate the loss
         loss = None
         if targets is not None:
             loss = F.cross_entropy(logits.view(-1, logits.size(-1)), targets.view(-1), ignore_index=0)  # -100 in the string space is mapped to 0 in the index space
+        if use_cache:
+            return logits, loss, presents
         return logits, loss
 
 class GPTforProbing(GPT):
@@ -13,6 +13,8 @@ import torch
 import torch.optim as optim
 from torch.optim.lr_scheduler import LambdaLR
 from torch.utils.data.dataloader import DataLoader
+
+from mingpt.loader import BatchLoader, has_batches
 from matplotlib import pyplot as plt
 
 logger = logging.getLogger(__name__)
@@ -32,6 +34,7 @@ class TrainerConfig:
     # checkpoint settings
     ckpt_path = None
     num_workers = 0 # for DataLoader
+    prefetch = 2 # batches prepared ahead when the dataset has get_batch (see mingpt/loader.py)
 
     def __init__(self, **kwargs):
         for k,v in kwargs.items():
@@ -98,18 +101,21 @@ class Trainer:
             is_train = split == 'train'
             model.train(is_train)
             data = self.train_dataset if is_train else self.test_dataset
-            loader = DataLoader(data, shuffle=True, pin_memory=True,
-                                batch_size=config.batch_size,
-                                num_workers=config.num_workers)
+            if has_batches(data):
+                loader = BatchLoader(data, config.batch_size, shuffle=True, pin_memory=True, prefetch=config.prefetch)
+            else:
+                loader = DataLoader(data, shuffle=True, pin_memory=True,
+                                    batch_size=config.batch_size,
+                                    num_workers=config.num_workers)
 
             losses = []
             totals_epoch = np.zeros(60, dtype=float)  # np.array of shape [60], for positions of age 0 to 59
             hits_epoch = np.zeros(60, dtype=float)  # np.array of shape [60], for positions of age 0 to 59
             pbar = tqdm(enumerate(loader), total=len(loader), disable=not prt) if is_train else enumerate(loader)
             for it, (x, y, age) in pbar:
-                x = x.to(self.device)  # [B, f]
-                y = y.to(self.device)  # [B, #task=64] 
-                age = age.to(self.device)  # [B, #task=64], in 0--59
+                x = x.to(self.device, non_blocking=True)  # [B, f]
+                y = y.to(self.device, non_blocking=True)  # [B, #task=64] 
+                age = age.to(self.device, non_blocking=True)  # [B, #task=64], in 0--59
 
                 with torch.set_grad_enabled(is_train):
                     logits, loss = model(x, y)
@@ -5,6 +5,7 @@ so nothing in this file really has anything to do with GPT specifically.
 
 import math
 import logging
+import itertools
 
 from tqdm import tqdm
 import numpy as np
@@ -12,8 +13,12 @@ import numpy as np
 import torch
 import torch.optim as optim
 from torch.optim.lr_scheduler import LambdaLR
+from torch.utils.data import IterableDataset
 from torch.utils.data.dataloader import DataLoader
 
+from mingpt.loader import BatchLoader, has_batches
+from data.tokenizer import tokenizer_path
+
 logger = logging.getLogger(__name__)
 
 class TrainerConfig:
@@ -31,6 +36,8 @@ class TrainerConfig:
     # checkpoint settings
     ckpt_path = None
     num_workers = 0 # for DataLoader
+    prefetch = 2 # batches prepared ahead when the dataset has get_batch (see mingpt/loader.py)
+    steps_per_epoch = None # batches per epoch of an endless IterableDataset, e.g. SyntheticGameDataset
 
     def __init__(self, **kwargs):
         for k,v in kwargs.items():
@@ -48,12 +55,28 @@ class Trainer:
         if torch.cuda.is_available():
             self.device = torch.cuda.current_device()
             self.model = torch.nn.DataParallel(self.model).to(self.device)
+        self.streams = {}  # split -> iterator over an IterableDataset, kept across epochs
+
+    def stream(self, split, data):
+        # steps_per_epoch batches of an endless dataset; the iterator lives on between epochs, so that every epoch
+        # gets new games instead of restarting the stream (and its producer processes) from the same seed
+        assert self.config.steps_per_epoch is not None, "set steps_per_epoch to train on an IterableDataset"
+        if split not in self.streams:
+            # a dataset yielding whole batches (batch_size set) must not be batched again
+            batch_size = None if getattr(data, "batch_size", None) is not None else self.config.batch_size
+            self.streams[split] = iter(DataLoader(data, batch_size=batch_size, pin_memory=True,
+                                                  num_workers=self.config.num_workers))
+        return itertools.islice(self.streams[split], self.config.steps_per_epoch)
 
     def save_checkpoint(self):
         # DataParallel wrappers keep raw model object in .module attribute
         raw_model = self.model.module if hasattr(self.model, "module") else self.model
         logger.info("saving %s", self.config.ckpt_path)
         torch.save(raw_model.state_dict(), self.config.ckpt_path)
+        # the vocabulary goes with the weights, so that the model can be used without its dataset
+        tokenizer = getattr(self.train_dataset, "tokenizer", None)
+        if tokenizer is not None:
+            tokenizer.save(tokenizer_path(self.config.ckpt_path))
 
     def train(self):
         model, config = self.model, self.config
@@ -64,17 +87,23 @@ class Trainer:
             is_train = split == 'train'
             model.train(is_train)
             data = self.train_dataset if is_train else self.test_dataset
-            loader = DataLoader(data, shuffle=True, pin_memory=True,
-                                batch_size=config.batch_size,
-                                num_workers=config.num_workers)
+            if isinstance(data, IterableDataset):
+                loader = self.stream(split, data)
+            elif has_batches(data):
+                loader = BatchLoader(data, config.batch_size, shuffle=True, pin_memory=True, prefetch=config.prefetch)
+            else:
+                loader = DataLoader(data, shuffle=True, pin_memory=True,
+                                    batch_size=config.batch_size,
+                                    num_workers=config.num_workers)
 
             losses = []
-            pbar = tqdm(enumerate(loader), total=len(loader)) if is_train else enumerate(loader)
+            total = config.steps_per_epoch if isinstance(data, IterableDataset) else len(loader)
+            pbar = tqdm(enumerate(loader), total=total) if is_train else enumerate(loader)
             for it, (x, y) in pbar:
 
                 # place data on the correct device
-                x = x.to(self.device)  # [B, T]
-                y = y.to(self.device)  # [B, T]
+                x = x.to(self.device, non_blocking=True)  # [B, T]
+                y = y.to(self.device, non_blocking=True)  # [B, T]
 
                 # forward the model
                 with torch.set_grad_enabled(is_train):
@@ -5,7 +5,9 @@ import torch.nn as nn
 from torch.nn import functional as F
 from matplotlib import pyplot as plt
 
-from data.othello import permit, start_hands, OthelloBoardState, permit_reverse
+from data.othello import permit, start_hands, OthelloBoardState, BatchedOthelloBoards, permit_reverse
+from data.tokenizer import OthelloTokenizer, PAD_TOKEN
+from mingpt.model import GPT
 
 def set_seed(seed):
     random.seed(seed)
@@ -19,21 +21,56 @@ def top_k_logits(logits, k):
     out[out < v[:, [-1]]] = -float('Inf')
     return out
 
+def mask_logits(logits, mask):
+    # logits of the tokens outside mask (bool, same shape) set to -inf, they get no probability after softmax
+    return logits.masked_fill(~mask, -float('Inf'))
+
+def legal_token_mask(valid, tokenizer):
+    # valid: [N, 64] boolean array of legal squares (board engine get_valid_array) -> [N, vocab_size] bool tensor
+    # of the tokens allowed next; a game without legal moves is over and can only continue with padding
+    mask = np.zeros((len(valid), tokenizer.vocab_size), dtype=bool)
+    mask[:, 1:] = valid[:, tokenizer.moves]
+    mask[:, PAD_TOKEN] = ~mask.any(axis=1)
+    return torch.from_numpy(mask)
+
+def supports_cache(model):
+    # GPT.forward with past_key_values, subclasses like GPTforProbing have a forward of their own
+    return isinstance(model, GPT) and type(model).forward is GPT.forward
+
 @torch.no_grad()
-def sample(model, x, steps, temperature=1.0, sample=False, top_k=None):
+def sample(model, x, steps, temperature=1.0, sample=False, top_k=None, use_cache=True, legal_only=False, tokenizer=None):
     """
     take a conditioning sequence of indices in x (of shape (b,t)) and predict the next token in
-    the sequence, feeding the predictions back into the model each time. Clearly the sampling
-    has quadratic complexity unlike an RNN that is only linear, and has a finite context window
-    of block_size, unlike an RNN that has an infinite context window.
+    the sequence, feeding the predictions back into the model each time. With use_cache the keys
+    and values of the sequence so far are kept (see GPT.forward) and every step only runs the model
+    on the token just sampled, so sampling is linear in the number of steps instead of quadratic;
+    the context window is still finite (block_size), once it is full every step starts over on the
+    cropped context.
+    With legal_only the games in x are replayed on the board engine (tokens decoded by tokenizer, the
+    default vocabulary if None) and every step can only produce a legal move: illegal logits are set
+    to -inf before top_k and softmax, instead of sampling freely and rejecting illegal moves.
     """
     block_size = model.get_block_size()
     model.eval()
+    use_cache = use_cache and supports_cache(model)
+    past = None
+    if legal_only:
+        tokenizer = OthelloTokenizer() if tokenizer is None else tokenizer
+        boards = BatchedOthelloBoards(x.size(0))
+        boards.update(tokenizer.decode(x.cpu().numpy()))
     for k in range(steps):
-        x_cond = x if x.size(1) <= block_size else x[:, -block_size:] # crop context if needed
-        logits, _ = model(x_cond)
+        if use_cache and past is not None and x.size(1) <= block_size:
+            logits, _, past = model(x[:, -1:], past_key_values=past, use_cache=True)
+        elif use_cache:
+            x_cond = x if x.size(1) <= block_size else x[:, -block_size:] # crop context if needed
+            logits, _, past = model(x_cond, use_cache=True)
+        else:
+            x_cond = x if x.size(1) <= block_size else x[:, -block_size:] # crop context if needed
+            logits, _ = model(x_cond)
         # pluck the logits at the final step and scale by temperature
         logits = logits[:, -1, :] / temperature
+        if legal_only:
+            logits = mask_logits(logits, legal_token_mask(boards.get_valid_array(), tokenizer).to(logits.device))
         # optionally crop probabilities to only the top k options
         if top_k is not None:
             logits = top_k_logits(logits, top_k)
@@ -46,6 +83,8 @@ def sample(model, x, steps, temperature=1.0, sample=False, top_k=None):
             _, ix = torch.topk(probs, k=1, dim=-1)
         # append to the sequence and continue
         x = torch.cat((x, ix), dim=1)
+        if legal_only:
+            boards.umpire(tokenizer.decode(ix[:, 0].cpu().numpy()))
 
     return x
 
@@ -7,11 +7,11 @@ import os
 import torch
 import numpy as np
 import time
-from data import get_othello
 from data.othello import OthelloBoardState
+from data.tokenizer import OthelloTokenizer
 from mingpt.model import GPT, GPTConfig
-from mingpt.dataset import CharDataset
-from mingpt.utils import sample
+from mingpt.utils import top_k_logits, mask_logits, legal_token_mask
+from torch.nn import functional as F
 
 
 class OthelloGPTAI:
@@ -24,19 +24,16 @@ class OthelloGPTAI:
         """
         print("🤖 Đang khởi tạo Othello GPT AI...")
 
-        # Load data để tạo dataset và vocab
-        print("📊 Loading championship data...")
-        othello = get_othello(data_root="data/othello_championship")
-        self.train_dataset = CharDataset(othello)
+        # Vocab cố định (60 ô + pad), lưu cạnh checkpoint; không cần load dataset
+        self.tokenizer = OthelloTokenizer.for_checkpoint(checkpoint_path) if checkpoint_path else OthelloTokenizer()
 
-        print(f"✅ Dataset: {len(self.train_dataset)} sequences")
-        print(f"✅ Vocab size: {self.train_dataset.vocab_size}")
-        print(f"✅ Block size: {self.train_dataset.block_size}")
+        print(f"✅ Vocab size: {self.tokenizer.vocab_size}")
+        print(f"✅ Block size: {self.tokenizer.block_size}")
 
         # Tạo model config
         mconf = GPTConfig(
-            self.train_dataset.vocab_size,
-            self.train_dataset.block_size,
+            self.tokenizer.vocab_size,
+            self.tokenizer.block_size,
             n_layer=8,
             n_head=8,
             n_embd=512
@@ -74,62 +71,108 @@ class OthelloGPTAI:
         self.model.to(self.device)
         self.model.eval()
 
+        # keys/values of the last game prefix fed to the model, see next_token_logits
+        self.cache_tokens = []
+        self.cache = None
+        self.cache_logits = None
+
         param_count = sum(p.numel() for p in self.model.parameters())
         print(f"🧠 GPT Model: {param_count:,} parameters")
         print(f"💻 Device: {self.device}")
         print("✅ Othello GPT AI ready!")
 
-    def predict_next_move(self, game_sequence, temperature=0.8, top_k=10):
+    @torch.no_grad()
+    def next_token_logits(self, tokens):
         """
-        Sử dụng GPT model để predict next move
-
-        Args:
-            game_sequence: List các moves đã chơi (integers)
-            temperature: Temperature cho sampling
-            top_k: Top-k sampling
-
-        Returns:
-            predicted_move: Move được predict (integer)
+        Logits của token tiếp theo sau tokens. Keys/values của prefix đã tính được giữ lại (KV cache),
+        nên mỗi nước đi mới chỉ cần chạy model trên các token mới.
         """
-        if len(game_sequence) == 0:
-            # First move thường ở giữa
-            return 26  # D4
+        n = len(self.cache_tokens)
+        if self.cache is not None and tokens == self.cache_tokens:
+            return self.cache_logits
+        if self.cache is not None and 0 < n < len(tokens) and tokens[:n] == self.cache_tokens:
+            x = torch.tensor(tokens[n:], dtype=torch.long).unsqueeze(0).to(self.device)
+            logits, _, self.cache = self.model(x, past_key_values=self.cache, use_cache=True)
+        else:
+            x = torch.tensor(tokens, dtype=torch.long).unsqueeze(0).to(self.device)
+            logits, _, self.cache = self.model(x, use_cache=True)
+        self.cache_tokens = list(tokens)
+        self.cache_logits = logits[0, -1]
+        return self.cache_logits
 
-        # Convert sequence to tokens
-        tokens = []
-        for move in game_sequence:
-            if move in self.train_dataset.stoi:
-                tokens.append(self.train_dataset.stoi[move])
-            else:
-                # Fallback cho moves không có trong vocab
-                tokens.append(0)
+    def encode_sequence(self, game_sequence):
+        """Convert moves thành tokens, cắt bớt nếu quá dài"""
+        # Moves không có trong vocab thành 0 (pad)
+        tokens = self.tokenizer.encode(list(game_sequence)).tolist()
 
         # Truncate nếu quá dài
-        max_len = self.train_dataset.block_size - 1
+        max_len = self.tokenizer.block_size - 1
         if len(tokens) > max_len:
             tokens = tokens[-max_len:]
+        return tokens
+
+    def legal_logits(self, game_sequence, legal_moves=None):
+        """
+        Logits của nước đi tiếp theo; nếu có legal_moves (list ô hợp lệ từ board engine) thì logits của
+        các nước không hợp lệ là -inf, mọi mẫu rút ra sau softmax đều hợp lệ
+        """
+        logits = self.next_token_logits(self.encode_sequence(game_sequence))
+        if legal_moves is not None:
+            valid = np.zeros((1, 64), dtype=bool)
+            valid[0, list(legal_moves)] = True
+            logits = mask_logits(logits, legal_token_mask(valid, self.tokenizer)[0].to(logits.device))
+        return logits
+
+    def sample_moves(self, game_sequence, temperatures, num_samples, top_k=10, legal_moves=None):
+        """
+        Lấy num_samples nước đi cho mỗi temperature từ một lần forward duy nhất:
+        logits chỉ tính một lần, tất cả các mẫu được rút bằng một lần torch.multinomial
 
-        # Convert to tensor
-        x = torch.tensor(tokens, dtype=torch.long).unsqueeze(0).to(self.device)
+        Args:
+            legal_moves: nếu có, chỉ rút các nước trong legal_moves (xem legal_logits)
+
+        Returns:
+            list (mỗi temperature) các list num_samples moves (integers, -1 nếu token không phải move)
+        """
+        if len(game_sequence) == 0:
+            # First move thường ở giữa
+            return [[26] * num_samples for _ in temperatures]  # D4
 
-        # Generate prediction
         with torch.no_grad():
-            # Sample next token
-            y = sample(self.model, x, 1, temperature=temperature, sample=True, top_k=top_k)[0]
-            predicted_token = y[-1].item()
+            logits = self.legal_logits(game_sequence, legal_moves)
+            temps = torch.tensor(temperatures, dtype=logits.dtype, device=logits.device).unsqueeze(1)
+            logits = logits.unsqueeze(0) / temps  # [#temperatures, vocab]
+            if top_k is not None:
+                logits = top_k_logits(logits, top_k)
+            tokens = torch.multinomial(F.softmax(logits, dim=-1), num_samples=num_samples, replacement=True)
+
+        # Convert token back to move
+        moves = self.tokenizer.decode(tokens).tolist()
+        return [[m if m >= 0 else -1 for m in row] for row in moves]
+
+    def predict_next_move(self, game_sequence, temperature=0.8, top_k=10, legal_moves=None):
+        """
+        Sử dụng GPT model để predict next move
 
-            # Convert token back to move
-            predicted_move = self.train_dataset.itos.get(predicted_token, -1)
+        Args:
+            game_sequence: List các moves đã chơi (integers)
+            temperature: Temperature cho sampling
+            top_k: Top-k sampling
+            legal_moves: nếu có, chỉ predict nước hợp lệ
 
-            return predicted_move
+        Returns:
+            predicted_move: Move được predict (integer)
+        """
+        return self.sample_moves(game_sequence, [temperature], 1, top_k=top_k, legal_moves=legal_moves)[0][0]
 
-    def choose_best_move(self, board_state, game_sequence):
+    def choose_best_move(self, board_state, game_sequence, greedy=False):
         """
-        Chọn nước đi tốt nhất từ GPT predictions
+        Chọn nước đi tốt nhất từ GPT predictions, chỉ trong các nước hợp lệ của board_state
 
         Args:
             board_state: OthelloBoardState object
             game_sequence: List các moves đã chơi
+            greedy: chọn nước hợp lệ có logit cao nhất thay vì bỏ phiếu giữa các mẫu
 
         Returns:
             best_move: Nước đi được chọn (integer position)
@@ -142,25 +185,24 @@ class OthelloGPTAI:
         if len(valid_moves) == 1:
             return valid_moves[0]
 
-        # Thử predict với nhiều temperature khác nhau
-        move_scores = {}
+        if greedy and len(game_sequence) > 0:
+            with torch.no_grad():
+                token = self.legal_logits(game_sequence, valid_moves).argmax().item()
+            return self.tokenizer.itos[token]
 
-        for temp in [0.5, 0.8, 1.0]:
-            for _ in range(5):  # Sample 5 lần cho mỗi temperature
-                predicted_move = self.predict_next_move(game_sequence, temperature=temp)
+        # Thử predict với nhiều temperature khác nhau, 5 mẫu cho mỗi temperature, chung một lần forward;
+        # logits đã được mask nên mọi mẫu đều hợp lệ, không cần loại bỏ hay fallback random
+        move_scores = {}
 
-                if predicted_move in valid_moves:
-                    if predicted_move not in move_scores:
-                        move_scores[predicted_move] = 0
-                    move_scores[predicted_move] += 1
+        for predicted_moves in self.sample_moves(game_sequence, [0.5, 0.8, 1.0], 5, legal_moves=valid_moves):
+            for predicted_move in predicted_moves:
+                if predicted_move not in move_scores:
+                    move_scores[predicted_move] = 0
+                move_scores[predicted_move] += 1
 
         # Chọn move có score cao nhất
-        if move_scores:
-            best_move = max(move_scores.items(), key=lambda x: x[1])[0]
-            return best_move
-
-        # Fallback: chọn random từ valid moves
-        return np.random.choice(valid_moves)
+        best_move = max(move_scores.items(), key=lambda x: x[1])[0]
+        return best_move
 
 
 def print_board(board_state):
@@ -184,8 +226,7 @@ def print_board(board_state):
         print(row)
 
     # Hiển thị điểm số
-    black_count = np.sum(board_state.state == 1)
-    white_count = np.sum(board_state.state == -1)
+    black_count, white_count = board_state.get_score()
 
     print(f"\n● Black: {black_count}  ○ White: {white_count}")
     print(f"Next player: {'● Black' if board_state.next_hand_color == 1 else '○ White'}")
@@ -255,8 +296,7 @@ def play_game():
 
             if not valid_moves_other:
                 # Game over
-                black_count = np.sum(board.state == 1)
-                white_count = np.sum(board.state == -1)
+                black_count, white_count = board.get_score()
 
                 print("\n🏁 GAME OVER!")
                 if black_count > white_count:
@@ -22,7 +22,7 @@ from torch.nn import functional as F
 from torch.utils.data import Dataset
 from torch.utils.data.dataloader import DataLoader
 from data import get_othello
-from data.othello import permit, start_hands, OthelloBoardState
+from data.othello import permit, start_hands, OthelloBoardState, BatchedOthelloBoards
 from mingpt.dataset import CharDataset
 from mingpt.model import GPT, GPTConfig, GPTforProbing
 from mingpt.probe_trainer import Trainer, TrainerConfig
@@ -87,25 +87,33 @@ if __name__ == '__main__':
         device = torch.cuda.current_device()
         model = model.to(device)
 
+    # ground truth of every game from one batched replay instead of one OthelloBoardState per game
+    games = np.full((len(othello), train_dataset.block_size), -100)
+    for i, seq in enumerate(othello.sequences):
+        seq = seq[:train_dataset.block_size]
+        games[i, :len(seq)] = seq
+    gt = BatchedOthelloBoards(len(games)).get_all_gt(games, ["get_" + args.exp, "get_age"])
+
     loader = DataLoader(train_dataset, shuffle=False, pin_memory=True, batch_size=1, num_workers=0)
-    act_container = []
+    # activations of every position of every game, filled in place: one [M, f] tensor and no per-game copies
+    num_positions = sum(min(len(seq), train_dataset.block_size) for seq in othello.sequences)
+    act_container = None
+    start = 0
     property_container = []
-    for x, y in tqdm(loader, total=len(loader)):
-        tbf = [train_dataset.itos[_] for _ in x.tolist()[0]]
-        valid_until = tbf.index(-100) if -100 in tbf else 999
-        a = OthelloBoardState()
-        properties = a.get_gt(tbf[:valid_until], "get_" + args.exp)  # [block_size, ]
-        act = model(x.to(device))[0, ...].detach().cpu()  # [block_size, f]
-        act_container.extend([_[0] for _ in act.split(1, dim=0)[:valid_until]])
-        property_container.extend(properties)
-
     age_container = []
-    for x, y in tqdm(loader, total=len(loader)):
+    for i, (x, y) in tqdm(enumerate(loader), total=len(loader)):
         tbf = [train_dataset.itos[_] for _ in x.tolist()[0]]
-        valid_until = tbf.index(-100) if -100 in tbf else 999
-        a = OthelloBoardState()
-        ages = a.get_gt(tbf[:valid_until], "get_age")  # [block_size, ]
-        age_container.extend(ages)
+        valid_until = tbf.index(-100) if -100 in tbf else len(tbf)
+        act = model(x.to(device))[0, ...].detach().cpu()  # [block_size, f]
+        if act_container is None:
+            act_container = torch.empty(num_positions, act.shape[-1], dtype=act.dtype)
+        act_container[start:start + valid_until] = act[:valid_until]
+        start += valid_until
+        property_container.append(gt["get_" + args.exp][i, :valid_until])
+        age_container.append(gt["get_age"][i, :valid_until])
+    assert start == num_positions
+    property_container = np.concatenate(property_container)
+    age_container = np.concatenate(age_container)
 
     if args.exp == "state":
         probe_class=3
@@ -120,7 +128,7 @@ if __name__ == '__main__':
             assert len(act) == len(y)
             assert len(act) == len(age)
             print(f"{len(act)} pairs loaded...")
-            self.act = act
+            self.act = act  # [M, f], so that batches are one indexing op (see get_batch)
             self.y = y
             self.age = age
             print(np.sum(np.array(y)==0), np.sum(np.array(y)==1), np.sum(np.array(y)==2))
@@ -136,6 +144,9 @@ if __name__ == '__main__':
             return len(self.y)
         def __getitem__(self, idx):
             return self.act[idx], torch.tensor(self.y[idx]).to(torch.long), torch.tensor(self.age[idx]).to(torch.long)
+        def get_batch(self, indices):
+            indices = torch.as_tensor(indices)
+            return self.act[indices], torch.from_numpy(self.y[indices.numpy()]).to(torch.long), torch.from_numpy(self.age[indices.numpy()]).to(torch.long)
 
     probing_dataset = ProbingDataset(act_container, property_container, age_container)
     train_size = int(0.8 * len(probing_dataset))